@@ -1,138 +1,42 @@
-import json
-import os
-import tkinter as tk
-from juptex.document import DocumentManager as Document
-from juptex.text import TextManager
-from juptex.algorithm import AlgorithmManager
-from juptex.notebook import isnotebook, register_cell_magic, \
-    register_line_magic
-from juptex.preview import genpng
-from juptex.utils import split_two_by_empty_line
-from juptex.author import Author, Institute
-
-
-global the_text_manager
-the_text_manager = TextManager()
-
-
-if isnotebook():
-  @register_cell_magic
-  def inline_math(line, content):
-    return the_text_manager._math_manager.view(content, '$')
-
-  @register_cell_magic
-  def block_math(line, content):
-    return the_text_manager._math_manager.view(content, line.strip())
-
-  @register_cell_magic
-  def tikz(line, content):
-    return genpng("\\begin{tikzpicture}\n" + content + "\n\\end{tikzpicture}",
-                  the_text_manager.render_meta())
-
-  @register_cell_magic
-  def tikzfig(line, content):
-    lines = content.split("\n")
-    title, content = split_two_by_empty_line(lines)
-    return genpng("\\begin{figure}\\centering\\begin{tikzpicture}\n" +
-                  "\n".join(content) + "\n\\end{tikzpicture}\n\\caption{" +
-                  "\n".join(title) +
-                  "}\n\\end{figure}",
-                  the_text_manager.render_meta())
-
-  @register_cell_magic
-  def tikzfigwide(line, content):
-    lines = content.split("\n")
-    title, content = split_two_by_empty_line(lines)
-    return genpng("\\begin{figure*}\\centering\\begin{tikzpicture}\n" +
-                  "\n".join(content) + "\n\\end{tikzpicture}\n\\caption{" +
-                  "\n".join(title) +
-                  "}\n\\end{figure*}",
-                  the_text_manager.render_meta())
-
-  @register_cell_magic
-  def algorithm(line, content):
-    algorithm = AlgorithmManager(text_manager=the_text_manager)
-    return algorithm.view(content, line)
-
-  @register_line_magic
-  def draw(line):
-    import english2tikz
-    name = line.strip().split(' ')[0]
-    di = english2tikz.DescribeIt()
-    with open("data/" + name + ".json") as f:
-      content = json.load(f)
-    di._picture = content["picture"]
-    content = di.render()
-    return genpng(content, the_text_manager.render_meta())
-
-  @register_line_magic
-  def drawgui(line):
-    name = line.strip().split(' ')[0]
-    filename = "data/" + name + ".json"
-    if not os.path.exists(filename):
-      with open(filename, "w") as f:
-        f.write("{}")
-    with open(filename) as f:
-      content = f.read()
-    launch_draw_gui(content, filename)
-
-  @register_cell_magic
-  def drawfig(line, content):
-    import english2tikz
-    title = content.strip()
-    name = line.strip()
-    di = english2tikz.DescribeIt()
-    with open("data/" + name + ".json") as f:
-      content = json.load(f)
-    di._picture = content["picture"]
-    content = di.render()
-    return genpng("\\begin{figure}\\centering\n" +
-                  content + "\n\\caption{" + title +
-                  "}\n\\end{figure}",
-                  the_text_manager.render_meta())
-
-  @register_cell_magic
-  def drawwide(line, content):
-    import english2tikz
-    title = content.strip()
-    name = line.strip()
-    di = english2tikz.DescribeIt()
-    with open("data/" + name + ".json") as f:
-      content = json.load(f)
-    di._picture = content["picture"]
-    content = di.render()
-    return genpng("\\begin{figure*}\\centering\n" +
-                  content + "\n\\caption{" + title +
-                  "}\n\\end{figure*}",
-                  the_text_manager.render_meta())
-
-  @register_cell_magic
-  def drawfiggui(line, content):
-    drawgui(line)
-
-  @register_line_magic
-  def drawslidegui(line):
-    drawgui(line)
-
-  @register_line_magic
-  def drawslide(line):
-    return draw(line)
-
-
-def launch_draw_gui(content, filename=None):
-  import english2tikz
-  screen_width, screen_height = 1200, 750
-  data = json.loads(content)
-  root = tk.Tk()
-  canvas = tk.Canvas(root, bg="white", width=screen_width,
-                     height=screen_height)
-  canvas.pack()
-
-  editor = english2tikz.Editor(root, canvas, screen_width, screen_height)
-  editor.load(data)
-  editor.filename = filename
-
-  root.title("Vim Draw")
-  root.minsize(screen_width, screen_height)
-  root.configure(bg="white")
-  root.mainloop()
+"""
+Importing juptex only loads this file. The names below are imported from
+their modules on first access, so that pybtex, IPython and the managers
+are only loaded when they are used, and the magics are registered in a
+notebook with `%load_ext juptex`.
+"""
+lazy_attributes = {
+    "Document": ("juptex.document", "DocumentManager"),
+    "TextManager": ("juptex.text", "TextManager"),
+    "AlgorithmManager": ("juptex.algorithm", "AlgorithmManager"),
+    "isnotebook": ("juptex.notebook", "isnotebook"),
+    "genpng": ("juptex.preview", "genpng"),
+    "split_two_by_empty_line": ("juptex.utils", "split_two_by_empty_line"),
+    "Author": ("juptex.author", "Author"),
+    "Institute": ("juptex.author", "Institute"),
+    "launch_draw_gui": ("juptex.magics", "launch_draw_gui"),
+}
+__all__ = list(lazy_attributes) + ["the_text_manager",
+                                   "load_ipython_extension"]
+
+
+def __getattr__(name):
+  if name == "the_text_manager":
+    from juptex.magics import get_text_manager
+    return get_text_manager()
+  if name not in lazy_attributes:
+    raise AttributeError(f"module 'juptex' has no attribute '{name}'")
+  import importlib
+  module, attribute = lazy_attributes[name]
+  value = getattr(importlib.import_module(module), attribute)
+  globals()[name] = value
+  return value
+
+
+def __dir__():
+  return sorted(list(globals()) + list(lazy_attributes) +
+                ["the_text_manager"])
+
+
+def load_ipython_extension(ipython):
+  from juptex.magics import load_ipython_extension
+  load_ipython_extension(ipython)
@@ -0,0 +1,42 @@
+"""
+Compilation of a generated math-heavy document by DocumentManager.
+
+Run with `python -m juptex.benchmarks.bench_document`. There is a section
+every ten equations, and every paragraph is followed by a display equation,
+which compile_cells folds into the paragraph as a placeholder and restores
+afterwards. The time per equation should stay roughly flat as the document
+grows to 2,000 equations.
+"""
+import time
+from juptex.document import DocumentManager
+
+
+def make_cells(equations):
+  cells = []
+  for i in range(equations):
+    if i % 10 == 0:
+      cells.append(("markdown", f"## Section {i // 10}"))
+    cells.append(("markdown",
+                  f"Paragraph {i} with $\\vec{{x}}_{{{i}}}\\in\\bbF^n$."))
+    cells.append(("code",
+                  f"%%block_math align\n\\label{{eqn:e{i}}}\n"
+                  f"a_{{{i}}} &= \\paren{{x}}+b_{{{i}}}"))
+  return [(index, *cell) for index, cell in enumerate(cells)]
+
+
+def main():
+  print("%10s %10s %16s" % ("equations", "seconds", "ms per equation"))
+  for equations in [250, 500, 1000, 2000]:
+    dm = DocumentManager("bench")
+    dm.disable_build_cache()
+    start = time.perf_counter()
+    cells = dm.preprocess_cells(make_cells(equations))
+    cells = dm.process_cells(cells, False)
+    list(dm.compile_cells(cells, False))
+    elapsed = time.perf_counter() - start
+    print("%10d %10.3f %16.3f" % (equations, elapsed,
+                                  elapsed * 1000 / equations))
+
+
+if __name__ == "__main__":
+  main()
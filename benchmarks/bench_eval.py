@@ -0,0 +1,51 @@
+"""
+Evaluation of the Python expressions in backticks and `!` lines.
+
+Run with `python -m juptex.benchmarks.bench_eval`. A generated paper of
+paragraphs refers 5,000 times to a few hundred labels, as in `sec_intro`,
+and its equations contain `!` lines over the same definitions.
+"""
+import time
+from juptex.text import TextManager
+
+
+def make_paragraphs(references, labels):
+  return [f"As shown in `thm_main_{i % labels}`, see also "
+          f"`sec_section_{i % 20}`." for i in range(references)]
+
+
+def make_equations(lines, labels):
+  return [f"!thm_main_{i % labels}" for i in range(lines)]
+
+
+def main():
+  tm = TextManager()
+  labels = 300
+  for i in range(labels):
+    tm.define(f"thm_main_{i}", f"Theorem~\\ref{{thm:main.{i}}}")
+  for i in range(20):
+    tm.define(f"sec_section_{i}", f"Section~\\ref{{sec:section.{i}}}")
+  print("%12s %10s %10s %14s" % ("kind", "count", "seconds", "us per item"))
+  paragraphs = make_paragraphs(5000, labels)
+  start = time.perf_counter()
+  for paragraph in paragraphs:
+    tm(paragraph)
+  elapsed = time.perf_counter() - start
+  print("%12s %10d %10.3f %14.2f" % ("backtick", 2 * len(paragraphs), elapsed,
+                                     elapsed * 1e6 / (2 * len(paragraphs))))
+  """
+  Each equation is distinct from the previous one, so the equation cache
+  of the math manager does not hide the evaluation.
+  """
+  mm = tm._math_manager
+  equations = make_equations(5000, labels)
+  start = time.perf_counter()
+  for i, equation in enumerate(equations):
+    mm(f"x_{{{i}}}\n{equation}")
+  elapsed = time.perf_counter() - start
+  print("%12s %10d %10.3f %14.2f" % ("! line", len(equations), elapsed,
+                                     elapsed * 1e6 / len(equations)))
+
+
+if __name__ == "__main__":
+  main()
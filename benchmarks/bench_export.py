@@ -0,0 +1,151 @@
+"""
+End-to-end timing of exporting a generated notebook, stage by stage,
+together with micro-benchmarks of the managers.
+
+Run with `python -m juptex.benchmarks.bench_export --output result.json`
+and compare the JSON of two runs. The notebook, the bib file and all the
+outputs live in a temporary directory. With `--trace trace.json`, a cold
+export is also traced, and the trace can be opened in chrome://tracing.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import juptex.cache
+import juptex.document
+import juptex.reference
+from juptex import tracing
+from juptex.document import DocumentManager
+from juptex.notebook import iter_cells
+from juptex.reference import Reference, find_citations
+from juptex.text import TextManager
+from juptex.paragraph import ParagraphManager
+from juptex.algorithm import AlgorithmManager
+from juptex.benchmarks.synthetic import make_notebook, make_bib
+
+
+def timed(f, *args):
+  start = time.perf_counter()
+  result = f(*args)
+  return result, time.perf_counter() - start
+
+
+def per_call(f, calls):
+  start = time.perf_counter()
+  for i in range(calls):
+    f(i)
+  return (time.perf_counter() - start) * 1e6 / calls
+
+
+def bench_stages(notebook, path):
+  stages = {}
+  dm = DocumentManager("benchmark")
+  dm.disable_build_cache()
+  cells, stages["get_cells"] = timed(
+      lambda: list(iter_cells(notebook)))
+  cells, stages["preprocess_cells"] = timed(dm.preprocess_cells, iter(cells))
+  cells, stages["process_cells"] = timed(dm.process_cells, cells, False)
+  cells, stages["compile_cells"] = timed(
+      lambda: list(dm.compile_cells(cells, False)))
+  os.makedirs(path, exist_ok=True)
+  _, stages["write_cells"] = timed(dm.write_cells, cells, path)
+
+  def reference():
+    reference = Reference()
+    reference.add_citations(key for cell in cells
+                            for key in find_citations(cell["content"]))
+    return reference
+  _, stages["reference"] = timed(reference)
+
+  for name, use_cache in [("export_cold", False), ("export", True),
+                          ("export_cached", True)]:
+    dm = DocumentManager("benchmark")
+    if not use_cache:
+      dm.disable_build_cache()
+    _, stages[name] = timed(dm, notebook)
+  return stages
+
+
+def trace_export(notebook, path):
+  dm = DocumentManager("benchmark")
+  dm.disable_build_cache()
+  tracing.enable()
+  try:
+    dm(notebook)
+  finally:
+    tracing.disable()
+  tracing.report()
+  tracing.dump(path)
+
+
+def bench_managers(calls):
+  tm = TextManager()
+  mm = tm._math_manager
+  pm = ParagraphManager(tm)
+  am = AlgorithmManager(text_manager=tm)
+  return {
+      "TextManager": per_call(lambda i: tm(
+          f"Sentence {i} with **bold**, $x_{{{i}}}$ and `2**5`."), calls),
+      "MathManager": per_call(lambda i: mm(
+          f"\\paren{{\\vec{{x}}_{{{i}}}}}\\cdot\\bbF^{{n}}"), calls),
+      "ParagraphManager": per_call(lambda i: pm(
+          f"Item {i}:\n- first $x$\n- second **y**\n  - nested"), calls),
+      "AlgorithmManager": per_call(lambda i: am(
+          f"title: Protocol {i}\ndef P($x$):\n  $\\sfP$ sends $x$\n"
+          f"  return $\\bbF$", f"alg{i}"), calls // 10),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+  parser.add_argument("--sections", type=int, default=20)
+  parser.add_argument("--paragraphs", type=int, default=20)
+  parser.add_argument("--equations", type=float, default=0.5)
+  parser.add_argument("--theorems", type=int, default=2)
+  parser.add_argument("--algorithms", type=int, default=1)
+  parser.add_argument("--citations", type=int, default=1)
+  parser.add_argument("--entries", type=int, default=1000)
+  parser.add_argument("--calls", type=int, default=2000)
+  parser.add_argument("--output")
+  parser.add_argument("--trace")
+  args = parser.parse_args()
+  params = {key: value for key, value in vars(args).items()
+            if key not in ["output", "trace"]}
+
+  with tempfile.TemporaryDirectory() as root:
+    juptex.document.essay_path = os.path.join(root, "essays")
+    juptex.reference.bib_path = os.path.join(root, "reference.bib")
+    juptex.cache.build_cache_path = os.path.join(root, "build")
+    notebook = os.path.join(root, "paper")
+    make_notebook(notebook, args.sections, args.paragraphs, args.equations,
+                  args.theorems, args.algorithms, args.citations,
+                  args.entries)
+    make_bib(juptex.reference.bib_path, args.entries)
+    stages = bench_stages(notebook, os.path.join(root, "stages"))
+    if args.trace is not None:
+      trace_export(notebook, args.trace)
+  managers = bench_managers(args.calls)
+
+  print("%20s %12s" % ("stage", "seconds"))
+  for name, seconds in stages.items():
+    print("%20s %12.4f" % (name, seconds))
+  print("%20s %12s" % ("manager", "us per call"))
+  for name, us in managers.items():
+    print("%20s %12.1f" % (name, us))
+  if args.output is not None:
+    with open(args.output, "w") as f:
+      json.dump({
+          "params": params,
+          "stages": stages,
+          "managers": managers,
+          "python": sys.version,
+          "platform": platform.platform(),
+          "time": time.time(),
+      }, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,46 @@
+"""
+Import time of juptex and of its modules, each in a fresh interpreter.
+
+Run with `python -m juptex.benchmarks.bench_import`. Besides the time, it
+lists the heavy dependencies that an import loads, which should be none
+for `import juptex`: they are only loaded when first used.
+"""
+import sys
+import json
+import subprocess
+import statistics
+
+
+heavy_modules = ["tkinter", "pybtex", "numbers_parser", "english2tikz",
+                 "pygame", "IPython", "pymupdf"]
+modules = ["juptex", "juptex.text", "juptex.reference", "juptex.document"]
+probe = """
+import sys, json, time
+start = time.perf_counter()
+import %s
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, sorted(set(
+    name.split(".")[0] for name in sys.modules) & set(%r))]))
+"""
+
+
+def measure(module, runs=5):
+  timings, loaded = [], []
+  for _ in range(runs):
+    output = subprocess.run([sys.executable, "-c",
+                             probe % (module, heavy_modules)],
+                            capture_output=True, text=True, check=True).stdout
+    seconds, loaded = json.loads(output)
+    timings.append(seconds)
+  return statistics.median(timings), loaded
+
+
+def main():
+  print("%18s %10s  %s" % ("module", "ms", "heavy modules loaded"))
+  for module in modules:
+    seconds, loaded = measure(module)
+    print("%18s %10.1f  %s" % (module, seconds * 1000, ", ".join(loaded)))
+
+
+if __name__ == "__main__":
+  main()
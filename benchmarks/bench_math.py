@@ -0,0 +1,32 @@
+"""
+Scaling of MathManager on long generated equations.
+
+Run with `python -m juptex.benchmarks.bench_math`. The equation is produced
+by a `!` Python line, as in generated align bodies, and the time per KB
+should stay roughly flat.
+"""
+import time
+from juptex.matheq import MathManager
+
+
+def make_equation(terms):
+  return ("\\begin{aligned}\n"
+          "!'+'.join(r'\\paren{\\vec{x}_{%d}}\\cdot\\bbF^{%d}' % (i, i) "
+          f"for i in range({terms}))\n"
+          "\\end{aligned}")
+
+
+def main():
+  mm = MathManager()
+  print("%10s %10s %10s %12s" % ("terms", "chars", "seconds", "us per KB"))
+  for terms in [100, 1000, 10000, 50000]:
+    equation = make_equation(terms)
+    start = time.perf_counter()
+    result = mm(equation)
+    elapsed = time.perf_counter() - start
+    print("%10d %10d %10.3f %12.1f" % (terms, len(result), elapsed,
+                                       elapsed * 1e6 / (len(result) / 1000)))
+
+
+if __name__ == "__main__":
+  main()
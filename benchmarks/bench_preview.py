@@ -0,0 +1,22 @@
+"""
+Time spent by pdflatex on preview snippets, with and without a format
+holding the preamble.
+
+Run with `python -m juptex.benchmarks.bench_preview` from a scratch
+directory; it needs pdflatex and mylatexformat.
+"""
+import tempfile
+import juptex.preview as preview
+
+
+def main(snippets=10):
+  for backend in ["pdflatex", "format"]:
+    preview.preview_backend = backend
+    for i in range(snippets):
+      with tempfile.TemporaryDirectory() as workdir:
+        preview.genpdf(r"$\sum_{i=1}^{%d} x_i$" % (i + 1), workdir=workdir)
+  print(preview.preview_timing_report())
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,50 @@
+"""
+Compare the in-process rasterizer with the pdfcrop and convert pipeline.
+
+Run with `python -m juptex.benchmarks.bench_rasterize [pdf]`. Without a
+pdf argument, a page with a formula-sized box of text is generated.
+Reports the time and the size of the resulting image for both paths;
+the pipeline is skipped if pdfcrop or convert is missing.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import juptex.preview as preview
+
+
+def make_pdf(path):
+  import pymupdf
+  doc = pymupdf.open()
+  page = doc.new_page()
+  page.insert_text((100, 100), "x_1 + x_2 + ... + x_n = Σ x_i", fontsize=11)
+  doc.save(path)
+
+
+def measure(f, pdf, output):
+  start = time.perf_counter()
+  f(pdf, output)
+  return time.perf_counter() - start, os.path.getsize(output)
+
+
+def main():
+  with tempfile.TemporaryDirectory() as workdir:
+    pdf = os.path.join(workdir, "view.pdf")
+    if len(sys.argv) > 1:
+      shutil.copy(sys.argv[1], pdf)
+    else:
+      make_pdf(pdf)
+    print("%-12s %6s %10s %12s" % ("path", "dpi", "seconds", "bytes"))
+    for dpi in [150, 300, 600]:
+      preview.preview_dpi = dpi
+      paths = [("pymupdf", preview.rasterize)]
+      if shutil.which("pdfcrop") and shutil.which("convert"):
+        paths.append(("pdfcrop", preview.convert_with_tools))
+      for name, f in paths:
+        seconds, size = measure(f, pdf, os.path.join(workdir, name + ".png"))
+        print("%-12s %6d %10.3f %12d" % (name, dpi, seconds, size))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,32 @@
+"""
+Scaling of TextManager on long paragraphs.
+
+Run with `python -m juptex.benchmarks.bench_text`. The time per KB should
+stay roughly flat from 10 KB to 1 MB.
+"""
+import time
+from juptex.text import TextManager
+
+
+sentence = (r"Let $\vec{x}\in\bbF^n$ be **given**, and _emph_ "
+            r"[[cite]] <u>under</u> `x` said \"quote\". ")
+
+
+def make_paragraph(size):
+  return sentence * max(1, size // len(sentence))
+
+
+def main():
+  tm = TextManager()
+  tm.define("x", "X")
+  print("%10s %10s %12s" % ("size", "seconds", "us per KB"))
+  for size in [10_000, 100_000, 1_000_000]:
+    content = make_paragraph(size)
+    start = time.perf_counter()
+    tm(content)
+    elapsed = time.perf_counter() - start
+    print("%10d %10.3f %12.1f" % (size, elapsed, elapsed * 1e6 / (size / 1000)))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,76 @@
+"""
+Generated notebooks and bib files for the benchmarks.
+
+The notebooks use the constructs of a typical paper: sections, paragraphs
+with inline math, cross references and citations, display equations,
+theorem environments and algorithms, in proportions set by the arguments.
+"""
+import json
+
+
+def make_notebook(path, sections=10, paragraphs=10, equations=0.5,
+                  theorems=2, algorithms=1, citations=1, entries=100):
+  """
+  Write the notebook to path + ".ipynb". Every paragraph is followed by a
+  display equation with probability equations, and cites the given number
+  of entries among the first entries keys of make_bib.
+  """
+  cells = []
+
+  def markdown(source):
+    cells.append({"cell_type": "markdown", "metadata": {},
+                  "source": source.splitlines(True)})
+
+  def code(source):
+    cells.append({"cell_type": "code", "metadata": {},
+                  "execution_count": None, "outputs": [],
+                  "source": source.splitlines(True)})
+
+  markdown("# Synthetic Paper")
+  markdown("## Abstract")
+  markdown("We study $\\bbF$-linear maps and their **costs**.")
+  count, equation = 0, 0.0
+  for s in range(sections):
+    markdown(f"## Section {s}")
+    for p in range(paragraphs):
+      keys = ", ".join(f"key{(count + i) % entries}"
+                       for i in range(citations))
+      cite = f" See [[{keys}]]." if citations > 0 else ""
+      text = (f"Paragraph {p} of `sec_section_{s}` with "
+              f"$\\vec{{x}}_{{{p}}}\\in\\bbF^{{n}}$ and _emphasis_.{cite}\n"
+              f"It computes `2**{p}`.")
+      if theorems > 0:
+        text += f" It refers to `thm_main_{s}_0`."
+      markdown(text)
+      count += citations
+      equation += equations
+      if equation >= 1:
+        equation -= 1
+        code(f"%%block_math align\n\\label{{eqn:s{s}p{p}}}\n"
+             f"a_{{{p}}} &= \\paren{{x_{{{s}}}}}+\\sum_{{i}} b_i")
+    for t in range(theorems):
+      markdown(f"**Theorem (Main {s} {t})**. For all $x\\in\\bbF$, "
+               f"the map is **linear**.\n\nSecond paragraph.")
+      markdown(f"**Proof**. By `sec_section_{s}`.")
+    for a in range(algorithms):
+      code(f"%%algorithm Alg {s} {a}\ntitle: Protocol {s}\n"
+           f"def P($x$):\n  $\\sfP$ sends $x$ to $\\sfV$\n"
+           f"  return $\\bbF$")
+  markdown("## Appendix")
+  markdown("More details on `sec_section_0`.")
+  markdown("# The End")
+  with open(f"{path}.ipynb", "w") as f:
+    json.dump({"cells": cells, "metadata": {}, "nbformat": 4,
+               "nbformat_minor": 5}, f)
+
+
+def make_bib(path, entries=100):
+  with open(path, "w") as f:
+    for i in range(entries):
+      f.write(f"@article{{key{i},\n"
+              f"  title = {{On {{T}}opic {i}}},\n"
+              f"  author = {{Smith, A. and Doe, J.}},\n"
+              f"  journal = {{Journal of Benchmarks}},\n"
+              f"  abstract = {{Removed from the output.}},\n"
+              f"  year = {{{2000 + i % 25}}},\n"
+              f"}}\n\n")
@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import bisect
+import threading
+import subprocess
+from collections import namedtuple, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from juptex.config import *
+
+
+LatexError = namedtuple("LatexError",
+                        ["file", "line", "message", "context", "cell"])
+BuildResult = namedtuple("BuildResult",
+                         ["path", "returncode", "errors", "seconds"])
+
+
+file_line_error_pattern = re.compile(r"(.+?\.tex):(\d+): (.*)")
+error_pattern = re.compile(r"! (.*)")
+
+
+class BuildManager(object):
+  """
+  Build documents with latexmk in the background.
+
+  At most one build of a directory runs at a time. The builds requested
+  while it runs are coalesced into a single build that starts after it,
+  so saving repeatedly never piles up builds of the same document.
+  """
+
+  def __init__(self, workers=None, command=None):
+    self._command = command if command is not None else build_command
+    self._executor = ThreadPoolExecutor(
+        max_workers=workers if workers is not None else build_workers)
+    self._lock = threading.Lock()
+    self._queued = {}
+    self.timings = deque(maxlen=1000)
+
+  def submit(self, path, source_map=None):
+    """
+    Return a Future of the BuildResult, which can be awaited in asyncio
+    through asyncio.wrap_future. The source map, from the name of a file
+    to the first lines and the notebook cells of its parts, is used to
+    locate the errors.
+    """
+    path = os.path.abspath(path)
+    with self._lock:
+      if path in self._queued:
+        future = (self._queued[path][0] if self._queued[path] is not None
+                  else Future())
+        self._queued[path] = (future, source_map)
+        return future
+      self._queued[path] = None
+    future = Future()
+    self._executor.submit(self._run, path, future, source_map)
+    return future
+
+  def _run(self, path, future, source_map):
+    while True:
+      if future.set_running_or_notify_cancel():
+        try:
+          future.set_result(self.build(path, source_map))
+        except Exception as e:
+          future.set_exception(e)
+      with self._lock:
+        if self._queued[path] is None:
+          del self._queued[path]
+          return
+        future, source_map = self._queued[path]
+        self._queued[path] = None
+
+  def build(self, path, source_map=None):
+    start = time.perf_counter()
+    process = subprocess.run(self._command, cwd=path,
+                             stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+    self.timings.append((path, seconds))
+    errors = []
+    log_path = os.path.join(path, "main.log")
+    if os.path.exists(log_path):
+      with open(log_path, errors="replace") as f:
+        errors = parse_log(f.read(), source_map)
+    return BuildResult(path, process.returncode, errors, seconds)
+
+  def shutdown(self):
+    self._executor.shutdown()
+
+
+def parse_log(content, source_map=None):
+  """
+  Extract the errors from a log written with -file-line-error, together
+  with the source line quoted after "l.<line>", and locate each of them
+  in the notebook. If there are none, the errors without a file, such as
+  a fatal error, are kept with the file and the line set to None.
+  """
+  ret = []
+  lines = content.split("\n")
+  for row, text in enumerate(lines):
+    match = file_line_error_pattern.match(text)
+    if not match:
+      continue
+    file, line = match.group(1), int(match.group(2))
+    context = None
+    for following in lines[row+1:row+12]:
+      if following.startswith(f"l.{line} "):
+        context = following[len(f"l.{line} "):]
+        break
+    ret.append(LatexError(file, line, match.group(3), context,
+                          locate(source_map, file, line)))
+  if len(ret) == 0:
+    for text in lines:
+      match = error_pattern.match(text)
+      if match:
+        ret.append(LatexError(None, None, match.group(1), None, None))
+  return ret
+
+
+def locate(source_map, file, line):
+  """
+  Return the index of the notebook cell that produced a line of file, or
+  None if it is not known.
+  """
+  if source_map is None:
+    return None
+  entries = source_map.get(os.path.basename(file))
+  if not entries:
+    return None
+  i = bisect.bisect_right([start for start, _ in entries], line) - 1
+  if i < 0:
+    return None
+  return entries[i][1]
+
+
+build_manager = None
+
+
+def get_build_manager():
+  global build_manager
+  if build_manager is None:
+    build_manager = BuildManager()
+  return build_manager
@@ -0,0 +1,442 @@
+import os
+import re
+import json
+import pickle
+import shutil
+import filecmp
+import hashlib
+import tempfile
+from types import ModuleType
+from functools import lru_cache
+from collections import namedtuple
+from juptex.config import *
+
+
+identifier_pattern = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+define_pattern = re.compile(
+    r"\bdefine\w*\(|\badd_meta\(|\\+define\w*\{")
+
+
+class Undescribable(Exception):
+  pass
+
+
+def find_identifiers(s):
+  return set(identifier_pattern.findall(s))
+
+
+def may_define(s):
+  """
+  Cells that call any of the define helpers mutate the shared definitions
+  while being compiled, so their output cannot be reused without losing
+  the side effect. Only calls are matched, e.g. `define("x", "y")` or
+  !definesf("A"), not prose like "well defined".
+  """
+  return define_pattern.search(s) is not None
+
+
+@lru_cache(maxsize=None)
+def source_hash():
+  """
+  The hash of the source of juptex, so that an upgrade that changes how
+  cells are compiled does not reuse the output of the older version.
+  """
+  h = hashlib.sha256()
+  root = os.path.dirname(os.path.abspath(__file__))
+  for name in sorted(os.listdir(root)):
+    if name.endswith(".py"):
+      with open(os.path.join(root, name), "rb") as f:
+        h.update(name.encode() + b"\0" + f.read())
+  return h.hexdigest()
+
+
+class BuildCache(object):
+  """
+  Compiled LaTeX of the cells of one notebook, persisted between exports.
+
+  A cell is keyed by its own content together with the values of every
+  definition it may depend on, so that changing a macro invalidates exactly
+  the cells that use it.
+  """
+
+  version = 2
+
+  def __init__(self, name, path=None):
+    self._path = os.path.join(path if path is not None else build_cache_path,
+                              f"{to_filename(name)}.json")
+    self._entries = {}
+    self._used = {}
+    self.hits = 0
+    self.misses = 0
+    if os.path.exists(self._path):
+      try:
+        with open(self._path) as f:
+          data = json.load(f)
+        if (data.get("version") == self.version and
+            data.get("source") == source_hash()):
+          self._entries = data.get("entries", {})
+      except (ValueError, OSError):
+        self._entries = {}
+
+  def fingerprint(self, cell, definitions):
+    """
+    The position of the cell in the notebook is not part of the key, so
+    inserting a cell does not invalidate the ones after it. Cells that
+    depend on a definition that cannot be described are not cached.
+    """
+    source = json.dumps({k: v for k, v in cell.items() if k != "index"},
+                        sort_keys=True)
+    if may_define(source):
+      return None
+    try:
+      dependencies = find_dependencies(source, definitions)
+    except Undescribable:
+      return None
+    h = hashlib.sha256(source.encode())
+    for name, value in sorted(dependencies.items()):
+      h.update(b"\0" + name.encode() + b"\0" + value.encode())
+    return h.hexdigest()
+
+  def get(self, key):
+    if key is None or key not in self._entries:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self._used[key] = self._entries[key]
+    return self._entries[key]
+
+  def set(self, key, content):
+    if key is None:
+      return
+    self._entries[key] = content
+    self._used[key] = content
+
+  def save(self):
+    """
+    Only the entries used by the latest build are kept, so the cache
+    does not grow with every edit.
+    """
+    os.makedirs(os.path.dirname(self._path), exist_ok=True)
+    write_if_changed(self._path, json.dumps({
+        "version": self.version,
+        "source": source_hash(),
+        "entries": self._used,
+    }))
+
+
+FileCacheInfo = namedtuple("FileCacheInfo",
+                           ["path", "entries", "size", "maxsize"])
+
+
+class FileCache(object):
+  """
+  Generated files addressed by the hash of whatever they are generated from.
+
+  The total size is kept under maxsize by evicting the least recently used
+  files first, using the modification time, which is refreshed on every hit.
+  """
+
+  def __init__(self, path, maxsize, suffix=""):
+    self._path = path
+    self._maxsize = maxsize
+    self._suffix = suffix
+
+  def key(self, *parts):
+    h = hashlib.sha256()
+    for part in parts:
+      if isinstance(part, str):
+        part = part.encode()
+      h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+  def path(self, key):
+    return os.path.join(self._path, key + self._suffix)
+
+  def get(self, key):
+    path = self.path(key)
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      return None
+    return path
+
+  def put(self, key, source):
+    """
+    Copy the file at source into the cache and return its path in the
+    cache, or source itself if it does not fit. The file is copied to a
+    temporary file of its own first, so that threads putting the same key
+    at the same time do not write to the same file.
+    """
+    size = os.path.getsize(source)
+    if size > self._maxsize:
+      return source
+    self.evict(self._maxsize - size)
+    os.makedirs(self._path, exist_ok=True)
+    path = self.path(key)
+    fd, temp = tempfile.mkstemp(dir=self._path, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f, open(source, "rb") as g:
+        shutil.copyfileobj(g, f)
+      os.replace(temp, path)
+    except BaseException:
+      remove_quietly(temp)
+      raise
+    return path
+
+  def _entries(self):
+    if not os.path.isdir(self._path):
+      return []
+    ret = []
+    for name in os.listdir(self._path):
+      if not name.endswith(self._suffix) or name.endswith(".tmp"):
+        continue
+      path = os.path.join(self._path, name)
+      try:
+        stat = os.stat(path)
+      except FileNotFoundError:
+        continue
+      ret.append((stat.st_mtime, stat.st_size, path))
+    return sorted(ret)
+
+  def evict(self, maxsize=None):
+    maxsize = self._maxsize if maxsize is None else maxsize
+    entries = self._entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if total <= maxsize:
+        break
+      remove_quietly(path)
+      total -= size
+
+  def info(self):
+    entries = self._entries()
+    return FileCacheInfo(self._path, len(entries),
+                         sum(size for _, size, _ in entries), self._maxsize)
+
+  def clear(self):
+    for _, _, path in self._entries():
+      remove_quietly(path)
+
+
+def remove_quietly(path):
+  """
+  Another thread or process sharing the cache may have removed the file.
+  """
+  try:
+    os.remove(path)
+  except FileNotFoundError:
+    pass
+
+
+def find_dependencies(source, definitions):
+  """
+  Return the description of every definition that source may refer to,
+  directly or through other definitions. Raise Undescribable if one of
+  them cannot be described.
+  """
+  ret = {}
+  todo = list(find_identifiers(source))
+  while len(todo) > 0:
+    name = todo.pop()
+    if name in ret or name not in definitions:
+      continue
+    value, referenced = describe_value(definitions[name])
+    ret[name] = value
+    todo.extend(referenced)
+  return ret
+
+
+def snapshot_definitions(definitions, defaults):
+  """
+  Split the definitions into those that can be sent to another process,
+  and the names of those that cannot. Definitions that the process builds
+  by itself, e.g. the lambdas of the common definitions, are in neither.
+  """
+  snapshot, unpicklable = {}, set()
+  for name, value in definitions.items():
+    if is_picklable(value):
+      snapshot[name] = value
+    elif name not in defaults or not same_value(defaults[name], value):
+      unpicklable.add(name)
+  return snapshot, unpicklable
+
+
+def is_picklable(value):
+  """
+  Functions, classes and their instances defined in the notebook are
+  pickled by reference to __main__, which the workers cannot resolve when
+  they are spawned rather than forked, so they are never sent, even inside
+  other values.
+  """
+  try:
+    data = pickle.dumps(value)
+    if b"__main__" in data:
+      return False
+    pickle.loads(data)
+    return True
+  except Exception:
+    return False
+
+
+def same_value(a, b):
+  try:
+    return describe_value(a) == describe_value(b)
+  except Undescribable:
+    return False
+
+
+def describe_value(value, seen=()):
+  """
+  Return a stable description of a definition and the identifiers it may
+  refer to, e.g. the macros used in a string or in the string constants of
+  a lambda. Raise Undescribable if the value cannot be described in the
+  same way by every export.
+  """
+  if isinstance(value, str):
+    return value, find_identifiers(value)
+  if isinstance(value, (int, float, complex, bool)) or value is None:
+    return repr(value), set()
+  if isinstance(value, ModuleType):
+    return f"module {value.__name__}", set()
+  if id(value) in seen:
+    raise Undescribable(f"Recursive definition: {value!r}")
+  seen = seen + (id(value),)
+  if isinstance(value, (list, tuple, set, frozenset, dict)):
+    if isinstance(value, dict):
+      items = [describe_value(item, seen) for item in value.items()]
+    else:
+      items = [describe_value(item, seen) for item in value]
+    descriptions = [description for description, _ in items]
+    if isinstance(value, (set, frozenset)):
+      descriptions.sort()
+    return (f"{type(value).__name__}{descriptions!r}",
+            set().union(*[referenced for _, referenced in items]))
+  if getattr(value, "__code__", None) is not None:
+    return describe_function(value, seen)
+  """
+  The managers of juptex hold the definitions themselves, which are
+  described on their own.
+  """
+  if is_juptex_module(getattr(type(value), "__module__", None)):
+    return type(value).__name__, set()
+  if (getattr(value, "__module__", None) == "__main__" and
+      isinstance(value, type)):
+    raise Undescribable(f"Class defined in the notebook: {value!r}")
+  try:
+    data = pickle.dumps(value, 4)
+  except Exception:
+    raise Undescribable(f"Cannot describe {value!r}")
+  return f"pickle {hashlib.sha256(data).hexdigest()}", set()
+
+
+def describe_function(f, seen):
+  """
+  A function is described by its code, including the constants of nested
+  code, its default arguments, the values it closes over and the globals
+  it reads. The globals of the functions of juptex are left to
+  source_hash.
+  """
+  description, referenced = describe_code(f.__code__, seen)
+  parts = [description]
+  defaults = (getattr(f, "__defaults__", None),
+              getattr(f, "__kwdefaults__", None))
+  for value in defaults:
+    part, names = describe_value(value, seen)
+    parts.append(part)
+    referenced |= names
+  for cell in getattr(f, "__closure__", None) or ():
+    try:
+      contents = cell.cell_contents
+    except ValueError:
+      parts.append("<empty>")
+      continue
+    part, names = describe_value(contents, seen)
+    parts.append(part)
+    referenced |= names
+  if not is_juptex_module(getattr(f, "__module__", None)):
+    globals_ = getattr(f, "__globals__", {})
+    for name in sorted(code_names(f.__code__)):
+      if name not in globals_:
+        continue
+      value = globals_[name]
+      if id(value) in seen:
+        parts.append(f"{name}=<recursive>")
+        continue
+      part, names = describe_value(value, seen)
+      parts.append(f"{name}={part}")
+      referenced |= names
+  return repr(parts), referenced
+
+
+def code_names(code):
+  names = set(code.co_names)
+  for const in code.co_consts:
+    if hasattr(const, "co_code"):
+      names |= code_names(const)
+  return names
+
+
+def is_juptex_module(module):
+  module = module or ""
+  return module == "juptex" or module.startswith("juptex.")
+
+
+def describe_code(code, seen):
+  parts = [code.co_code.hex(), repr(code.co_names)]
+  referenced = set(code.co_names)
+  for const in code.co_consts:
+    if hasattr(const, "co_code"):
+      part, names = describe_code(const, seen)
+    else:
+      part, names = describe_value(const, seen)
+    parts.append(part)
+    referenced |= names
+  return repr(parts), referenced
+
+
+def to_filename(name):
+  return re.sub(r"[^\w\-.]", "_", name)
+
+
+def write_if_changed(path, content):
+  """
+  Write content to path unless the file already holds exactly this content,
+  so that the modification time of unchanged outputs is preserved. The
+  file is replaced atomically, so it is never seen half written.
+  Return whether the file is written.
+  """
+  if os.path.exists(path):
+    with open(path) as f:
+      if f.read() == content:
+        return False
+  with open(path + ".tmp", "w") as f:
+    f.write(content)
+  os.replace(path + ".tmp", path)
+  return True
+
+
+def replace_if_changed(source, path):
+  """
+  Move the file at source to path, unless path already holds exactly the
+  same content, in which case source is removed instead.
+  Return whether path is replaced.
+  """
+  if os.path.exists(path) and filecmp.cmp(source, path, shallow=False):
+    os.remove(source)
+    return False
+  os.replace(source, path)
+  return True
+
+
+def copy_if_changed(source, path):
+  """
+  Copy the file at source to path, with its modification time, unless
+  path already holds the same content. The files are first compared by
+  size and modification time, and by content only if those differ.
+  Return whether path is replaced.
+  """
+  if os.path.exists(path) and filecmp.cmp(source, path, shallow=True):
+    return False
+  shutil.copy2(source, path + ".tmp")
+  os.replace(path + ".tmp", path)
+  return True
@@ -5,6 +5,36 @@ import os
 root_path = os.path.join(os.getenv("HOME"), ".juptex")
 essay_path = os.path.join(os.getenv("HOME"), "Documents/Essays")
 slide_path = os.path.join(os.getenv("HOME"), "Documents/Slides")
+build_cache_path = os.path.join(root_path, "build")
+table_cache_path = os.path.join(root_path, "tables")
+
+# Preview configurations
+preview_cache_path = os.path.join(root_path, "preview")
+preview_cache_size = 256 * 1024 * 1024
+# Previews are rendered as "png" at preview_dpi, or as "svg"
+preview_format = "png"
+preview_dpi = 300
+# Number of previews rendered at the same time in the background in a
+# notebook, 0 renders each preview in ./view before returning it
+preview_workers = 0
+# "pdflatex" compiles every preview from scratch, "format" loads the
+# preamble from a format dumped once per distinct preamble
+preview_backend = "pdflatex"
+format_path = os.path.join(root_path, "formats")
+
+# Drawing configurations
+# The TikZ rendered from the english2tikz drawings in data/*.json
+drawing_cache_path = os.path.join(root_path, "drawings")
+drawing_cache_size = 16 * 1024 * 1024
+# Number of processes rendering the drawings missing from the cache at the
+# same time when exporting, 0 renders them one by one
+drawing_workers = 4
+
+# Build configurations
+build_command = ["latexmk", "-pdfxe", "-interaction=nonstopmode",
+                 "-file-line-error", "main.tex"]
+# Number of documents built at the same time in the background
+build_workers = 2
 
 # Matheq configurations
 python_mark = "!"
@@ -12,6 +42,7 @@ instruction_mark = "%%",
 line_splitter = "@"
 space_holder = "~"
 math_indent = 2
+math_cache_size = 4096
 
 # Text parser configurations
 python_start_mark, python_end_mark = "`", "`"
@@ -25,6 +56,8 @@ raw_start_mark, raw_end_mark = "<raw>", "</raw>"
 pre_start_mark, pre_end_mark = "<code>", "</code>"
 hide_start_mark, hide_end_mark = "<span hidden>", "</span>"
 space_placeholder = "<space>"
+# Number of compiled Python expressions, from backticks and ! lines, kept
+expression_cache_size = 4096
 bib_path = os.path.join(root_path, "reference.bib")
 
 # Reference
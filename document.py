@@ -1,13 +1,13 @@
 import os
 import re
 import json
+import threading
+import traceback
 import subprocess
-from pybtex.database import parse_file, BibliographyData
 from pathlib import Path
 from juptex.config import *
 from juptex.matheq import *
 from juptex.text import *
-# from juptex.table import *
 from juptex.figure import *
 from juptex.algorithm import *
 from juptex.paragraph import *
@@ -17,8 +17,19 @@ from juptex.keywords import *
 from juptex.author import *
 from juptex.notebook import *
 from juptex.reference import *
+from juptex import tracing
+from juptex.labels import LabelRegistry
+from juptex.drawing import drawing_path, render_drawing, render_drawings
+from juptex.build import get_build_manager
+from juptex.cache import (BuildCache, write_if_changed, replace_if_changed,
+                          copy_if_changed, may_define, find_dependencies,
+                          snapshot_definitions, Undescribable)
 
 
+math_code_pattern = re.compile(r"mathequationcode\d+code")
+main_placeholder_pattern = re.compile(
+    r"<author>|<date>|<keywords>|<title>|<meta>")
+
 class DocumentManager(object):
   def __init__(self, name, text_manager=None, math_manager=None):
     self._name = name
@@ -32,6 +43,11 @@ class DocumentManager(object):
     self._title = ""
     self._outline_each_section = False
     self._hide_subsections = False
+    self._use_build_cache = True
+    self._build_cache = None
+    self._workers = 0
+    self._labels = LabelRegistry()
+    self._source_map = {}
     self.define("mm", self.get_mm())
 
   def anonymous(self):
@@ -43,6 +59,16 @@ class DocumentManager(object):
   def hide_subsections(self):
     self._hide_subsections = True
 
+  def disable_build_cache(self):
+    self._use_build_cache = False
+
+  def parallel(self, workers=None):
+    """
+    Compile the paragraphs, figures, tables and algorithms in a pool of
+    worker processes. The output is the same as compiling them in order.
+    """
+    self._workers = workers if workers is not None else os.cpu_count()
+
   def set_title(self, title):
     self._title = title
 
@@ -77,51 +103,81 @@ class DocumentManager(object):
   def add_keyword(self, keyword):
     self._keywords.add_keyword(keyword)
 
+  @tracing.traced("export")
   def __call__(self, notebook, template="lncs"):
     is_slide = template == "beamer"
     target_path = slide_path if is_slide else essay_path
-    cells = get_cells(notebook)
+    cells = iter_cells(notebook)
+    self._build_cache = (BuildCache(self._name) if self._use_build_cache
+                         else None)
     preprocessed_cells = self.preprocess_cells(cells)
     processed_cells = self.process_cells(preprocessed_cells, is_slide)
-    compiled_cells = self.compile_cells(processed_cells, is_slide)
-    abstract, body, appendix = self.post_process(compiled_cells, is_slide)
-    self.copy_template(template)
-    reference = Reference()
-    reference.extract_citations(abstract)
-    reference.extract_citations(body)
-    reference.extract_citations(appendix)
-    reference.dump(os.path.join(target_path, self._name, "reference.bib"))
-    if len(abstract) > 0:
-      with open(os.path.join(target_path, self._name, "abstract.tex"),
-                "w") as f:
-        f.write(abstract)
-    if len(body) > 0:
-      with open(os.path.join(target_path, self._name, "body.tex"), "w") as f:
-        f.write(body)
-    if len(abstract) > 0:
-      with open(os.path.join(target_path, self._name, "appendix.tex"),
-                "w") as f:
-        f.write(r"\begin{appendix}")
-        f.write(appendix)
-        f.write(r"\end{appendix}")
-    with open(os.path.join(target_path, self._name, "main.tex")) as f:
+    path = os.path.join(target_path, self._name)
+    os.makedirs(path, exist_ok=True)
+    try:
+      written = self.write_cells(
+          self.compile_cells(processed_cells, is_slide), path)
+    finally:
+      if self._build_cache is not None:
+        self._build_cache.save()
+        self._build_cache = None
+    self.copy_template(template, written + ["main.tex"])
+    with open(os.path.join(Path(__file__).parent.absolute(), "templates",
+                           template, "main.tex")) as f:
       content = f.read()
-    content = content.replace("<author>", self._render_author(template))
-    content = content.replace("<date>", self._render_date())
-    content = content.replace("<keywords>", self._keywords.dump())
-    content = content.replace("<title>", self._title)
-    content = content.replace("<meta>", self._render_meta(is_slide))
-    with open(os.path.join(target_path, self._name, "main.tex"), "w") as f:
-      f.write(content)
-  
+    values = {
+        "<author>": self._render_author(template),
+        "<date>": self._render_date(),
+        "<keywords>": self._keywords.dump(),
+        "<title>": self._title,
+        "<meta>": self._render_meta(is_slide),
+    }
+    content = main_placeholder_pattern.sub(
+        lambda match: values[match.group()], content)
+    write_if_changed(os.path.join(path, "main.tex"), content)
+
   def compile(self, template="lncs"):
+    """
+    Build the exported document in the background and return a Future of
+    the BuildResult. The errors are printed with the notebook cells they
+    come from when the build finishes.
+    """
     is_slide = template == "beamer"
     target_path = slide_path if is_slide else essay_path
-    compile = subprocess.Popen(["latexmk", "-pdfxe",
-                      "-interaction=nonstopmode", "main.tex"],
-                     cwd=os.path.join(target_path, self._name),
-                     stdout=subprocess.PIPE)
-    grep = subprocess.Popen(["grep", "-A 10", "-e", r'^\!.*$'], stdin=compile.stdout)
+    future = get_build_manager().submit(
+        os.path.join(target_path, self._name), self._source_map)
+    future.add_done_callback(report_build)
+    return future
+
+  def watch(self, notebook, template="lncs", interval=1):
+    """
+    Export and build the notebook every time it is saved, until the
+    returned event is set.
+    """
+    stop = threading.Event()
+
+    def loop():
+      mtime = None
+      while not stop.is_set():
+        """
+        The notebook may be missing for a moment while it is saved, in
+        which case this poll is skipped.
+        """
+        try:
+          current = os.path.getmtime(f"{notebook}.ipynb")
+        except OSError:
+          current = mtime
+        if current != mtime:
+          mtime = current
+          try:
+            self(notebook, template)
+            self.compile(template)
+          except Exception:
+            traceback.print_exc()
+        stop.wait(interval)
+
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
 
   def open(self, template="lncs"):
     is_slide = template == "beamer"
@@ -172,23 +228,39 @@ class DocumentManager(object):
   """
     return ret
 
-  def copy_template(self, template):
+  @tracing.traced("copy_template")
+  def copy_template(self, template, exclude=()):
+    """
+    Copy the files of the template that are missing or changed, except
+    the ones in exclude, which are generated.
+    """
     is_slide = template == "beamer"
     target_path = slide_path if is_slide else essay_path
-    script_path = Path(__file__).parent.absolute()
-    if not os.path.isdir(os.path.join(target_path, self._name)):
-      os.mkdir(os.path.join(target_path, self._name))
-    os.system(f"cp {script_path}/templates/{template}/* "
-              f"'{os.path.join(target_path, self._name)}'")
+    template_path = os.path.join(Path(__file__).parent.absolute(),
+                                 "templates", template)
+    os.makedirs(os.path.join(target_path, self._name), exist_ok=True)
+    for name in sorted(os.listdir(template_path)):
+      source = os.path.join(template_path, name)
+      if name in exclude or not os.path.isfile(source):
+        continue
+      copy_if_changed(source, os.path.join(target_path, self._name, name))
 
+  @tracing.traced("preprocess_cells")
   def preprocess_cells(self, cells):
+    """
+    The cells may be a generator, which is not consumed beyond the end
+    of the document. Every cell remembers the index of the notebook cell
+    it comes from, as given by iter_cells, which is carried on to the
+    cells derived from it, down to the compiled cells.
+    """
     ret = []
-    for type_, content in cells:
+    self._labels = LabelRegistry()
+    for index, type_, content in cells:
       if type_ == "markdown":
         cell = self._preprocess_markdown(content)
         if cell is not None:
           if cell.get("type") == "end":
-            return ret
+            break
           ret.append(cell)
       elif type_ == "code":
         cell = self._preprocess_code(content)
@@ -196,8 +268,14 @@ class DocumentManager(object):
           ret.append(cell)
       else:
         raise ValueError(f"Unexpected type {type_}")
+      if cell is not None:
+        cell["index"] = index
     return ret
 
+  def _define_label(self, name, label, ref):
+    self._labels.register(name, label, ref)
+    self.define(name, ref)
+
   def _preprocess_markdown(self, content):
     if len(content.strip()) == 0:
       return {"type": "empty"}
@@ -208,18 +286,21 @@ class DocumentManager(object):
     label_matches = re.findall(r"\\label\{([^}]+)\}", content)
     for label in label_matches:
       if label.startswith("eqn"):
-        self.define(to_word(label), f"(\\ref{{{label}}})")
+        self._define_label(to_word(label), label, f"(\\ref{{{label}}})")
         self.define(to_word(label)+"_full", f"Equation~(\\ref{{{label}}})")
       elif label.startswith("def"):
-        self.define(to_word(label), f"Definition~\\ref{{{label}}}")
+        self._define_label(to_word(label), label,
+                           f"Definition~\\ref{{{label}}}")
       elif label.startswith("lem"):
-        self.define(to_word(label), f"Lemma~\\ref{{{label}}}")
+        self._define_label(to_word(label), label, f"Lemma~\\ref{{{label}}}")
       elif label.startswith("thm"):
-        self.define(to_word(label), f"Theorem~\\ref{{{label}}}")
+        self._define_label(to_word(label), label,
+                           f"Theorem~\\ref{{{label}}}")
       elif label.startswith("col"):
-        self.define(to_word(label), f"Corollary~\\ref{{{label}}}")
+        self._define_label(to_word(label), label,
+                           f"Corollary~\\ref{{{label}}}")
       else:
-        self.define(to_word(label), f"\\ref{{{label}}}")
+        self._define_label(to_word(label), label, f"\\ref{{{label}}}")
     
     lines = content.split("\n")
     start_line = lines[0].strip()
@@ -354,8 +435,8 @@ class DocumentManager(object):
       label = to_label(comments[0])
     else:
       label = to_label(title)
-    self.define(f"{prefix}_{to_word(label)}",
-                r"Section~\ref{%s:%s}" % (prefix, label))
+    self._define_label(f"{prefix}_{to_word(label)}", f"{prefix}:{label}",
+                       r"Section~\ref{%s:%s}" % (prefix, label))
     return title, label
 
   def _preprocess_environment(self, lines, env_name, title, rest):
@@ -376,8 +457,9 @@ class DocumentManager(object):
           "Remark": "rmk",
           "Definition": "def",
       }[env_name]
-      self.define("%s_%s" % (prefix, to_word(label)),
-                  r"%s~\ref{%s:%s}" % (env_name, prefix, label))
+      self._define_label("%s_%s" % (prefix, to_word(label)),
+                         "%s:%s" % (prefix, label),
+                         r"%s~\ref{%s:%s}" % (env_name, prefix, label))
 
     ret_lines = []
     for i in range(len(lines)):
@@ -409,10 +491,11 @@ class DocumentManager(object):
       name = start_line[12:].strip()
       is_wide = AlgorithmManager(self._text_manager).is_wide(
           "\n".join(lines[1:]))
-      self.define("alg_" + to_word(name),
-                  r"Algorithm~\ref{alg:" + to_label(name) + "}"
-                  if not is_wide else
-                  r"Figure~\ref{fig:" + to_label(name) + "}")
+      self._define_label("alg_" + to_word(name),
+                         ("alg:" if not is_wide else "fig:") + to_label(name),
+                         r"Algorithm~\ref{alg:" + to_label(name) + "}"
+                         if not is_wide else
+                         r"Figure~\ref{fig:" + to_label(name) + "}")
       return {
           "type": "algorithm",
           "content": "\n".join(lines[1:]),
@@ -432,13 +515,11 @@ class DocumentManager(object):
       enclose_figure = enclose_figure or start_line.startswith("%%drawwide")
       title = "\n".join(lines[1:]) if enclose_figure else None
       if enclose_figure:
-        self.define("fig_" + to_word(filename),
-                    r"Figure~\ref{fig:" + to_label(filename) + "}")
-      with open(f"data/{filename}.json") as f:
-        content = f.read()
+        self._define_label("fig_" + to_word(filename),
+                           "fig:" + to_label(filename),
+                           r"Figure~\ref{fig:" + to_label(filename) + "}")
       return {
           "type": "draw",
-          "content": content,
           "name": filename,
           "title": title,
           "slidetitle": slide_title,
@@ -449,11 +530,9 @@ class DocumentManager(object):
       filename = start_line[start_line.find(' ')+1:].strip()
       title = filename[filename.find(' ')+1:]
       filename = filename[:filename.find(' ')]
-      with open(f"data/{filename}.json") as f:
-        content = f.read()
       return {
           "type": "drawslide",
-          "content": content,
+          "name": filename,
           "title": title,
       }
     if start_line.startswith('%%tikz '):
@@ -480,8 +559,8 @@ class DocumentManager(object):
       if name.find('scale:') >= 0:
         scale = name[name.find('scale:')+6:].strip()
         name = name[:name.find('scale:')].strip()
-      self.define("fig_" + to_word(name),
-                  r"Figure~\ref{fig:" + to_label(name) + "}")
+      self._define_label("fig_" + to_word(name), "fig:" + to_label(name),
+                         r"Figure~\ref{fig:" + to_label(name) + "}")
       empty_line = lines.index("")
       if empty_line >= 0:
         title = "\n".join(lines[1:empty_line])
@@ -511,7 +590,7 @@ class DocumentManager(object):
       labels = find_all_labels(content)
       for label in labels:
         self.define(to_word(label)+"_full", r"Equation~(\ref{%s})" % label)
-        self.define(to_word(label), r"(\ref{%s})" % label)
+        self._define_label(to_word(label), label, r"(\ref{%s})" % label)
       return {
           "type": "math",
           "content": content,
@@ -520,8 +599,8 @@ class DocumentManager(object):
     if start_line.startswith("%%figure "):
       path = start_line[9:].strip()
       name = os.path.basename(os.path.splitext(path)[0])
-      self.define("fig_" + to_word(name),
-                  r"Figure~\ref{fig:%s}" % to_label(name))
+      self._define_label("fig_" + to_word(name), "fig:" + to_label(name),
+                         r"Figure~\ref{fig:%s}" % to_label(name))
       return {
           "type": "figure",
           "path": path,
@@ -531,8 +610,8 @@ class DocumentManager(object):
     if start_line.startswith("%%widefigure "):
       path = start_line[13:].strip()
       name = os.path.basename(os.path.splitext(path)[0])
-      self.define("fig_" + to_word(name),
-                  r"Figure~\ref{fig:%s}" % to_label(name))
+      self._define_label("fig_" + to_word(name), "fig:" + to_label(name),
+                         r"Figure~\ref{fig:%s}" % to_label(name))
       return {
           "type": "figure",
           "path": path,
@@ -543,8 +622,8 @@ class DocumentManager(object):
     if start_line.startswith("%%table "):
       path = start_line[8:].strip()
       name = os.path.basename(os.path.splitext(path)[0])
-      self.define("tab_" + to_word(name),
-                  r"Table~\ref{tab:%s}" % to_label(name))
+      self._define_label("tab_" + to_word(name), "tab:" + to_label(name),
+                         r"Table~\ref{tab:%s}" % to_label(name))
       return {
           "type": "table",
           "path": path,
@@ -554,8 +633,8 @@ class DocumentManager(object):
     if start_line.startswith("%%widetable "):
       path = start_line[12:].strip()
       name = os.path.basename(os.path.splitext(path)[0])
-      self.define("tab_" + to_word(name),
-                  r"Table~\ref{tab:%s}" % to_label(name))
+      self._define_label("tab_" + to_word(name), "tab:" + to_label(name),
+                         r"Table~\ref{tab:%s}" % to_label(name))
       return {
           "type": "table",
           "path": path,
@@ -565,6 +644,7 @@ class DocumentManager(object):
       }
     return None
 
+  @tracing.traced("process_cells")
   def process_cells(self, cells, is_slide):
     ret = []
     """
@@ -575,6 +655,7 @@ class DocumentManager(object):
     """
     started_environment = None
     for cell in cells:
+      start = len(ret)
       if started_environment is not None:
         if cell.get("type") not in ["text", "math"]:
           ret.append({"type": "end_" + started_environment})
@@ -614,12 +695,12 @@ class DocumentManager(object):
               is_slide and cell.get("type") == "draw"
               and cell.get("title") is not None):
         ret.append({"type": "startslide", "title": cell.get("title")})
-        ret.append({"type": "draw", "content": cell.get("content")})
+        ret.append({"type": "draw", "name": cell.get("name")})
         ret.append({"type": "endslide"})
       elif cell.get("type") == "draw" and (
               is_slide and cell.get("slidetitle") is not None):
         ret.append({"type": "startslide", "title": cell.get("slidetitle")})
-        ret.append({"type": "draw", "content": cell.get("content")})
+        ret.append({"type": "draw", "name": cell.get("name")})
         ret.append({"type": "endslide"})
       elif cell.get("type") in ["theorem", "lemma", "corollary",
                                 "remark", "definition", "proof"]:
@@ -638,6 +719,8 @@ class DocumentManager(object):
         started_environment = cell.get("type")
       else:
         ret.append(cell)
+      for new_cell in ret[start:]:
+        new_cell.setdefault("index", cell.get("index"))
     """
     Second pass: filter out slide or non-slide contents
     and mark slides as fragile if it contains verb
@@ -665,9 +748,37 @@ class DocumentManager(object):
           slide_started = cell
         elif slide_started is None:
           ret.append(cell)
+    """
+    The labels are only checked in the cells that are kept, so that the
+    references in the slides left out of an essay are not reported.
+    """
+    for cell in ret:
+      self._labels.refer(json.dumps(cell))
+    self._labels.check(self._locals)
     return ret
 
   def compile_cells(self, cells, is_slide):
+    """
+    Yield the compiled cells one by one, so that write_cells writes each
+    of them out as soon as it is compiled. Cells marked merge_next are
+    merged with the cells after them on the way.
+    """
+    def f(cell):
+      return cell
+
+    def g(new_cell, original_cell, next_cell):
+      if original_cell.get("merge_next", False):
+        return {
+            "belong": new_cell.get("belong"),
+            "content": new_cell["content"] + "\n" + next_cell["content"],
+            "index": new_cell.get("index"),
+        }
+      return None
+
+    with tracing.span("compile_cells"):
+      yield from iter_with_merge(self._compile_cells(cells, is_slide), f, g)
+
+  def _compile_cells(self, cells, is_slide):
     """
     Require at least two passes, because we must first compile
     the math equations, then connect them with the paragraphs.
@@ -686,7 +797,9 @@ class DocumentManager(object):
         new_cell["type"] = "text"
         return new_cell
       elif cell.get("type") == "math":
+        start = tracing.begin()
         content = self._text_manager.compile_math(cell["content"])
+        tracing.end("math_cell", start, index=cell.get("index"), type="math")
         if cell["env"] == "$":
           content = f"${content}$"
         elif cell["env"] == r"\[":
@@ -703,13 +816,17 @@ class DocumentManager(object):
         return {
             "type": "text",
             "content": code,
+            "index": cell.get("index"),
         }
       return cell
 
     def g(new_cell, original_cell, next_cell):
       nonlocal code_count, code_dictionary
       if next_cell.get("type") == "math":
+        start = tracing.begin()
         content = self._text_manager.compile_math(next_cell["content"])
+        tracing.end("math_cell", start, index=next_cell.get("index"),
+                    type="math")
         if next_cell["env"] == "$":
           content = f"${content}$"
         elif next_cell["env"] == r"\[":
@@ -727,19 +844,28 @@ class DocumentManager(object):
           return {
               "type": "text",
               "content": new_cell["content"] + code,
+              "index": new_cell.get("index"),
           }
       
       if original_cell.get("type") == "math":
         if next_cell.get("type") == "paragraph":
           return {
               "type": "text",
-              "content": new_cell["content"] + "\n" + next_cell["content"]
+              "content": new_cell["content"] + "\n" + next_cell["content"],
+              "index": new_cell.get("index"),
           }
 
       return None
 
     cells = map_with_merge(cells, f, g)
 
+    """
+    The drawings missing from their cache are rendered all at once before
+    the second pass, which then finds them in the cache.
+    """
+    render_drawings([cell.get("name") for cell in cells
+                     if cell.get("type") == "draw"], fit=True)
+
     """
     Second pass: compilation
     """
@@ -748,7 +874,43 @@ class DocumentManager(object):
     target_path = slide_path if is_slide else essay_path
     slide_started = False
     started_environment = None
+    """
+    A cell that may change the definitions is a barrier: the cells before
+    it are compiled first, and it is compiled in order, so that every cell
+    sees the same definitions as when compiled one by one. The compiled
+    cells are only held until no cell before them is pending, and then
+    yielded with the codes set back.
+    """
+    pending = [] if self._workers > 0 else None
+    barrier = False
+
+    def restore(match):
+      code = match.group()
+      if code not in code_dictionary:
+        return code
+      return "\n" + code_dictionary[code]
+
+    def flush():
+      for new_cell in ret:
+        new_cell["content"] = math_code_pattern.sub(restore,
+                                                    new_cell["content"])
+        yield new_cell
+      ret.clear()
+
+    def compile_cell(cell, kind):
+      if pending is None or barrier:
+        return self._compile_cached(cell, getattr(self, f"_compile_{kind}"))
+      pending.append((len(ret), kind, cell))
+      return None
+
     for cell in cells:
+      start = len(ret)
+      began = tracing.begin()
+      if pending is not None:
+        barrier = may_define(json.dumps(cell))
+        if barrier and pending:
+          self._compile_pending(ret, pending)
+          pending.clear()
       if cell.get("type") == "section":
         belong = "body"
         ret.append({
@@ -799,56 +961,23 @@ class DocumentManager(object):
       elif cell.get("type") == "text":
         ret.append({
             "belong": belong,
-            "content": ParagraphManager(self._text_manager)(
-                cell.get("content"))
+            "content": compile_cell(cell, "text")
         })
       elif cell.get("type") == "tikz":
-        title = cell.get("title")
-        content = cell.get("content")
-        content = r"""\begin{tikzpicture}
-%s
-\end{tikzpicture}""" % content
-        scale = cell.get("scale")
-        if scale is not None:
-          content = r"\scalebox{%s}{%s}" % (scale, content)
-        content = r"\begin{center}%s\end{center}" % content
-        env = "figure" if not cell.get("wide", False) else "figure*"
-        if title is not None:
-          content = r"""\begin{%s}[ht]\centering
-%s
-\caption{%s}\label{fig:%s}
-\end{%s}""" % (env, content,
-               self._text_manager(cell.get("title")),
-               to_label(cell.get("name")), env)
         ret.append({
             "belong": belong,
-            "content": content
+            "content": compile_cell(cell, "tikz")
         })
       elif cell.get("type") == "draw":
-        title = cell.get("title")
-        content = json.loads(cell.get("content"))
-        import english2tikz
-        di = english2tikz.DescribeIt()
-        di._picture = content["picture"]
-        if "width" in content and "height" in content:
-          width, height = content["width"], content["height"]
-          di._scale = min(1, 11/width, 7/height)
-        content = di.render()
-        env = "figure" if not cell.get("wide", False) else "figure*"
-        if title is not None:
-          content = r"""\begin{%s}[ht]\centering
-%s
-\caption{%s}\label{fig:%s}
-\end{%s}""" % (env, content,
-               self._text_manager(cell.get("title")),
-               to_label(cell.get("name")), env)
-        else:
-          content = r"""\begin{center}
-%s
-\end{center}""" % content
+        """
+        The drawing is not part of the cell either.
+        """
         ret.append({
             "belong": belong,
-            "content": content
+            "content": compile_cell(
+                {**cell, "mtime": os.path.getmtime(
+                    drawing_path(cell.get("name")))},
+                "draw")
         })
       elif cell.get("type") == "figure":
         content = FigureManager(
@@ -863,23 +992,22 @@ class DocumentManager(object):
             "content": content
         })
       elif cell.get("type") == "table":
-        tm = TableManager(text_manager=self._text_manager)
-        tabulars = tm.read(cell.get("path"))
-        tabulars[0].get_row(0).set_header()
-        if cell.get("wide", False):
-          tm.wide()
-        content = tm(tabulars, cell.get("title"),
-                     "tab:" + to_label(cell.get("name")))
+        """
+        The spreadsheet is not part of the cell, so its signature is added
+        to the key of the build cache. A Numbers package is a directory
+        whose modification time does not change when the files in it do.
+        """
+        from juptex.table import file_signature
         ret.append({
             "belong": belong,
-            "content": content
+            "content": compile_cell(
+                {**cell, "signature": file_signature(cell.get("path"))},
+                "table")
         })
       elif cell.get("type") == "algorithm":
-        am = AlgorithmManager(text_manager=self._text_manager)
-        content = am(cell.get("content"), cell.get("name"))
         ret.append({
             "belong": belong,
-            "content": content
+            "content": compile_cell(cell, "algorithm")
         })
       elif cell.get("type") == "empty":
         continue
@@ -910,6 +1038,12 @@ class DocumentManager(object):
         started_environment = None
       else:
         raise ValueError(f"Unknown cell {cell}")
+      for new_cell in ret[start:]:
+        new_cell["index"] = cell.get("index")
+      tracing.end("cell", began, index=cell.get("index"),
+                  type=cell.get("type"))
+      if not pending:
+        yield from flush()
 
     if slide_started:
       raise ValueError("Unended slide at the end of the document")
@@ -917,42 +1051,216 @@ class DocumentManager(object):
     if started_environment is not None:
       raise ValueError(f"Unended environment {started_environment}")
 
-    cells = ret
+    if pending:
+      self._compile_pending(ret, pending)
+      pending.clear()
+    yield from flush()
+
+  def _compile_cached(self, cell, compile):
+    if self._build_cache is None:
+      return compile(cell)
+    key = self._build_cache.fingerprint(cell, self._locals)
+    content = self._build_cache.get(key)
+    tracing.count("build_cache.hits" if content is not None
+                  else "build_cache.misses")
+    if content is None:
+      content = compile(cell)
+      self._build_cache.set(key, content)
+    return content
 
+  @tracing.traced("compile_pending")
+  def _compile_pending(self, cells, pending):
     """
-    Set the codes back.
+    Cells depending on definitions that cannot be sent to the workers are
+    compiled in this process, and so are the hits of the build cache.
     """
-    for cell in cells:
-      for code, content in code_dictionary.items():
-        cell["content"] = cell["content"].replace(code, "\n"+content)
+    snapshot, unpicklable = snapshot_definitions(
+        self._locals, DocumentManager(self._name)._locals)
+    jobs = []
+    for index, kind, cell in pending:
+      source = json.dumps(cell, sort_keys=True)
+      try:
+        local = bool(unpicklable &
+                     set(find_dependencies(source, self._locals)))
+      except Undescribable:
+        local = True
+      if local:
+        cells[index]["content"] = self._compile_cached(
+            cell, getattr(self, f"_compile_{kind}"))
+        continue
+      key = None
+      if self._build_cache is not None:
+        key = self._build_cache.fingerprint(cell, self._locals)
+        content = self._build_cache.get(key)
+        tracing.count("build_cache.hits" if content is not None
+                      else "build_cache.misses")
+        if content is not None:
+          cells[index]["content"] = content
+          continue
+      jobs.append((index, kind, cell, key))
+    if len(jobs) == 0:
+      return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(min(self._workers, len(jobs)),
+                             initializer=_init_worker,
+                             initargs=(self._name, snapshot)) as executor:
+      results = executor.map(_compile_in_worker,
+                             [kind for _, kind, _, _ in jobs],
+                             [cell for _, _, cell, _ in jobs],
+                             chunksize=max(1, len(jobs) // (4 * self._workers)))
+      for (index, _, _, key), content in zip(jobs, results):
+        cells[index]["content"] = content
+        if self._build_cache is not None:
+          self._build_cache.set(key, content)
+
+  def _compile_text(self, cell):
+    return ParagraphManager(self._text_manager)(cell.get("content"))
+
+  def _compile_tikz(self, cell):
+    title = cell.get("title")
+    content = cell.get("content")
+    content = r"""\begin{tikzpicture}
+%s
+\end{tikzpicture}""" % content
+    scale = cell.get("scale")
+    if scale is not None:
+      content = r"\scalebox{%s}{%s}" % (scale, content)
+    content = r"\begin{center}%s\end{center}" % content
+    env = "figure" if not cell.get("wide", False) else "figure*"
+    if title is not None:
+      content = r"""\begin{%s}[ht]\centering
+%s
+\caption{%s}\label{fig:%s}
+\end{%s}""" % (env, content,
+               self._text_manager(cell.get("title")),
+               to_label(cell.get("name")), env)
+    return content
 
+  def _compile_draw(self, cell):
+    title = cell.get("title")
+    content = render_drawing(cell.get("name"), fit=True)
+    env = "figure" if not cell.get("wide", False) else "figure*"
+    if title is not None:
+      content = r"""\begin{%s}[ht]\centering
+%s
+\caption{%s}\label{fig:%s}
+\end{%s}""" % (env, content,
+               self._text_manager(cell.get("title")),
+               to_label(cell.get("name")), env)
+    else:
+      content = r"""\begin{center}
+%s
+\end{center}""" % content
+    return content
+
+  def _compile_table(self, cell):
+    from juptex.table import TableManager
+    tm = TableManager(text_manager=self._text_manager)
+    tabulars = tm.read(cell.get("path"))
+    tabulars[0].get_row(0).set_header()
+    if cell.get("wide", False):
+      tm.wide()
+    return tm(tabulars, cell.get("title"),
+              "tab:" + to_label(cell.get("name")))
+
+  def _compile_algorithm(self, cell):
+    am = AlgorithmManager(text_manager=self._text_manager)
+    return am(cell.get("content"), cell.get("name"))
+
+  @tracing.traced("write_cells")
+  def write_cells(self, cells, path):
     """
-    Merge
+    Write each compiled cell to the part of the document it belongs to as
+    soon as it comes from compile_cells, so that neither the compiled cells
+    nor the parts are ever held in memory as a whole. The parts go to
+    temporary files first, and only replace the existing ones after all
+    the citations are found, and only if changed.
+    Return the names of the files of the parts that are written, and
+    remember the first line of every cell in them to locate LaTeX errors.
     """
-    def f(cell):
-      return cell
+    parts = ["abstract", "body", "appendix"]
+    files, counts, sizes, citations = {}, {}, {}, {}
+    lines, source_map = {}, {}
+    reference = Reference()
+    try:
+      for part in parts:
+        files[part] = open(os.path.join(path, f"{part}.tex.tmp"), "w")
+        counts[part], sizes[part], citations[part] = 0, 0, {}
+        lines[part], source_map[f"{part}.tex"] = 0, []
+      files["appendix"].write(r"\begin{appendix}")
+      for cell in cells:
+        part = cell.get("belong")
+        if part not in files:
+          raise ValueError(f"Unknown belong {part}")
+        content = cell.get("content")
+        if counts[part] > 0:
+          content = "\n\n" + content
+        source_map[f"{part}.tex"].append(
+            (lines[part] + (3 if counts[part] > 0 else 1), cell.get("index")))
+        lines[part] += content.count("\n")
+        files[part].write(content)
+        counts[part] += 1
+        sizes[part] += len(content)
+        citations[part].update(dict.fromkeys(find_citations(content)))
+      files["appendix"].write(r"\end{appendix}")
+      for f in files.values():
+        f.close()
+      """
+      The citations are added part by part, which decides the order of
+      the entries in reference.bib.
+      """
+      for part in parts:
+        reference.add_citations(citations[part])
+    except Exception:
+      for part, f in files.items():
+        f.close()
+        os.remove(os.path.join(path, f"{part}.tex.tmp"))
+      raise
+    reference.dump(os.path.join(path, "reference.bib"))
+    """
+    The appendix is only written along with the abstract.
+    """
+    written = {
+        "abstract": sizes["abstract"] > 0,
+        "body": sizes["body"] > 0,
+        "appendix": sizes["abstract"] > 0,
+    }
+    for part in parts:
+      if written[part]:
+        replace_if_changed(os.path.join(path, f"{part}.tex.tmp"),
+                           os.path.join(path, f"{part}.tex"))
+      else:
+        os.remove(os.path.join(path, f"{part}.tex.tmp"))
+    self._source_map = source_map
+    return [f"{part}.tex" for part in parts if written[part]]
 
-    def g(new_cell, original_cell, next_cell):
-      if original_cell.get("merge_next", False):
-        return {
-            "belong": new_cell.get("belong"),
-            "content": new_cell["content"] + "\n" + next_cell["content"],
-        }
-      return None
 
-    cells = map_with_merge(cells, f, g)
+def report_build(future):
+  if future.cancelled():
+    return
+  if future.exception() is not None:
+    print(f"Build failed: {future.exception()}")
+    return
+  result = future.result()
+  for error in result.errors:
+    where = (f"{error.file}:{error.line}" if error.file is not None
+             else result.path)
+    if error.cell is not None:
+      where += f" (cell {error.cell})"
+    print(f"{where}: {error.message}")
+    if error.context is not None:
+      print(f"  {error.context}")
 
-    return cells
 
-  def post_process(self, cells, is_slide):
-    abstract, body, appendix = [], [], []
-    for cell in cells:
-      if cell.get("belong") == "abstract":
-        abstract.append(cell.get("content"))
-      elif cell.get("belong") == "body":
-        body.append(cell.get("content"))
-      elif cell.get("belong") == "appendix":
-        appendix.append(cell.get("content"))
-      else:
-        raise ValueError(f"Unknown belong {cell.get('belong')}")
-    return "\n\n".join(abstract), "\n\n".join(body), "\n\n".join(appendix)
+_worker_manager = None
+
+
+def _init_worker(name, definitions):
+  global _worker_manager
+  _worker_manager = DocumentManager(name)
+  _worker_manager.disable_build_cache()
+  _worker_manager.set_local_variables(definitions)
+
+
+def _compile_in_worker(kind, cell):
+  return getattr(_worker_manager, f"_compile_{kind}")(cell)
@@ -0,0 +1,96 @@
+import os
+import json
+import tempfile
+from juptex import tracing
+from juptex.config import *
+from juptex.cache import FileCache
+
+
+"""
+The TikZ of the english2tikz drawings in data/<name>.json, shared by the
+magics and the export. A drawing is keyed by the hash of its JSON file and
+whether it is scaled to fit the page, so it is only rendered again when
+the file changes, and the JSON is only parsed to render it.
+"""
+drawing_cache = FileCache(drawing_cache_path, drawing_cache_size, ".tex")
+
+
+def drawing_path(name):
+  return os.path.join("data", f"{name}.json")
+
+
+def read_drawing(name):
+  with open(drawing_path(name), "rb") as f:
+    return f.read()
+
+
+def drawing_key(source, fit=False):
+  return drawing_cache.key(source, "fit" if fit else "")
+
+
+def render_drawing(name, fit=False):
+  source = read_drawing(name)
+  key = drawing_key(source, fit)
+  content = cached_drawing(key)
+  if content is None:
+    content = render_picture(source, fit)
+    store_drawing(key, content)
+  return content
+
+
+def render_drawings(names, fit=False, workers=None):
+  """
+  Render the drawings missing from the cache all at once, each in a
+  process of its own, so that render_drawing finds them in the cache.
+  """
+  workers = drawing_workers if workers is None else workers
+  missing = {}
+  for name in dict.fromkeys(names):
+    source = read_drawing(name)
+    key = drawing_key(source, fit)
+    if key not in missing and drawing_cache.get(key) is None:
+      missing[key] = source
+  if workers <= 1 or len(missing) <= 1:
+    return
+  from concurrent.futures import ProcessPoolExecutor
+  with ProcessPoolExecutor(min(workers, len(missing))) as executor:
+    results = executor.map(render_picture, missing.values(),
+                           [fit] * len(missing))
+    for key, content in zip(missing, results):
+      store_drawing(key, content)
+
+
+def cached_drawing(key):
+  path = drawing_cache.get(key)
+  tracing.count("drawing_cache.hits" if path is not None
+                else "drawing_cache.misses")
+  if path is None:
+    return None
+  with open(path) as f:
+    return f.read()
+
+
+def store_drawing(key, content):
+  fd, path = tempfile.mkstemp(suffix=".tex")
+  try:
+    with os.fdopen(fd, "w") as f:
+      f.write(content)
+    drawing_cache.put(key, path)
+  finally:
+    os.remove(path)
+
+
+@tracing.traced("render_picture")
+def render_picture(source, fit=False):
+  """
+  The exported drawings are scaled down to fit in 11 by 7 if their size
+  is known.
+  """
+  import english2tikz
+  content = json.loads(source)
+  di = english2tikz.DescribeIt()
+  di._picture = content["picture"]
+  if fit and "width" in content and "height" in content:
+    width, height = content["width"], content["height"]
+    di._scale = min(1, 11/width, 7/height)
+  return di.render()
@@ -3,3 +3,6 @@ class MathEquationError(Exception):
 
 class AlgorithmError(Exception):
   pass
+
+class LabelError(Exception):
+  pass
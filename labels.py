@@ -0,0 +1,85 @@
+import re
+import warnings
+from collections import namedtuple
+from juptex.errors import LabelError
+
+
+Label = namedtuple("Label", ["kind", "label", "ref"])
+
+
+label_kinds = [
+    "sec", "subsec", "thm", "lem", "col", "rmk", "def", "alg", "fig", "tab",
+    "eqn",
+]
+reference_pattern = re.compile(
+    r"(?<!`)`((?:%s)_\w+)`(?!`)" % "|".join(label_kinds))
+definition_pattern = re.compile(
+    r"\bdefine\(\s*\\?[\"']((?:%s)_\w+)\\?[\"']" % "|".join(label_kinds))
+
+
+class LabelRegistry(object):
+  """
+  The labels of a document by the name that refers to them in backticks,
+  e.g. thm_main for \\label{thm:main}, collected while preprocessing the
+  cells, together with the label-like names the cells refer to, so that
+  all the problems are reported at once before compiling.
+  """
+
+  def __init__(self):
+    self._labels = {}
+    self._duplicates = {}
+    self._references = set()
+    self._defined = set()
+
+  def register(self, name, label, ref):
+    kind = label.split(":")[0] if ":" in label else ""
+    entry = Label(kind, label, ref)
+    if name in self._labels:
+      self._duplicates.setdefault(name, [self._labels[name]]).append(entry)
+    self._labels[name] = entry
+
+  def refer(self, content):
+    """
+    Names passed to define in the content, e.g. `define("thm_x", "...")`,
+    only exist once the cell is compiled, so they are remembered as known.
+    """
+    self._references.update(reference_pattern.findall(content))
+    self._defined.update(definition_pattern.findall(content))
+
+  def unknown(self, definitions):
+    return sorted(name for name in self._references
+                  if name not in self._labels and name not in self._defined
+                  and name not in definitions)
+
+  def duplicates(self):
+    return dict(self._duplicates)
+
+  def check(self, definitions):
+    """
+    Raise for references to undefined labels, which would otherwise fail
+    one by one when the text is compiled, and warn for labels defined more
+    than once, which LaTeX would only warn about.
+    """
+    messages = []
+    unknown = self.unknown(definitions)
+    if len(unknown) > 0:
+      messages.append("Unknown labels: " + ", ".join(unknown))
+    for name, entries in sorted(self._duplicates.items()):
+      messages.append("Duplicate label %s: %s" % (
+          name, ", ".join(entry.label for entry in entries)))
+    if len(unknown) > 0:
+      raise LabelError("\n".join(messages))
+    if len(messages) > 0:
+      warnings.warn("\n".join(messages))
+
+  def __contains__(self, name):
+    return name in self._labels
+
+  def __getitem__(self, name):
+    return self._labels[name]
+
+  def __iter__(self):
+    return iter(self._labels)
+
+  def __len__(self):
+    return len(self._labels)
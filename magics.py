@@ -0,0 +1,139 @@
+import json
+import os
+from juptex.preview import genpng
+from juptex.drawing import drawing_path, render_drawing
+from juptex.utils import split_two_by_empty_line
+
+
+"""
+The cell and line magics of the notebooks, registered by
+`%load_ext juptex`. The text manager shared by the magics is only created
+when a magic first needs it.
+"""
+the_text_manager = None
+
+
+def get_text_manager():
+  global the_text_manager
+  if the_text_manager is None:
+    from juptex.text import TextManager
+    the_text_manager = TextManager()
+  return the_text_manager
+
+
+def inline_math(line, content):
+  return get_text_manager()._math_manager.view(content, '$')
+
+
+def block_math(line, content):
+  return get_text_manager()._math_manager.view(content, line.strip())
+
+
+def tikz(line, content):
+  return genpng("\\begin{tikzpicture}\n" + content + "\n\\end{tikzpicture}",
+                get_text_manager().render_meta())
+
+
+def tikzfig(line, content):
+  lines = content.split("\n")
+  title, content = split_two_by_empty_line(lines)
+  return genpng("\\begin{figure}\\centering\\begin{tikzpicture}\n" +
+                "\n".join(content) + "\n\\end{tikzpicture}\n\\caption{" +
+                "\n".join(title) +
+                "}\n\\end{figure}",
+                get_text_manager().render_meta())
+
+
+def tikzfigwide(line, content):
+  lines = content.split("\n")
+  title, content = split_two_by_empty_line(lines)
+  return genpng("\\begin{figure*}\\centering\\begin{tikzpicture}\n" +
+                "\n".join(content) + "\n\\end{tikzpicture}\n\\caption{" +
+                "\n".join(title) +
+                "}\n\\end{figure*}",
+                get_text_manager().render_meta())
+
+
+def algorithm(line, content):
+  from juptex.algorithm import AlgorithmManager
+  algorithm = AlgorithmManager(text_manager=get_text_manager())
+  return algorithm.view(content, line)
+
+
+def draw(line):
+  name = line.strip().split(' ')[0]
+  content = render_drawing(name)
+  return genpng(content, get_text_manager().render_meta())
+
+
+def drawgui(line):
+  name = line.strip().split(' ')[0]
+  filename = drawing_path(name)
+  if not os.path.exists(filename):
+    with open(filename, "w") as f:
+      f.write("{}")
+  with open(filename) as f:
+    content = f.read()
+  launch_draw_gui(content, filename)
+
+
+def drawfig(line, content):
+  title = content.strip()
+  content = render_drawing(line.strip())
+  return genpng("\\begin{figure}\\centering\n" +
+                content + "\n\\caption{" + title +
+                "}\n\\end{figure}",
+                get_text_manager().render_meta())
+
+
+def drawwide(line, content):
+  title = content.strip()
+  content = render_drawing(line.strip())
+  return genpng("\\begin{figure*}\\centering\n" +
+                content + "\n\\caption{" + title +
+                "}\n\\end{figure*}",
+                get_text_manager().render_meta())
+
+
+def drawfiggui(line, content):
+  drawgui(line)
+
+
+def drawslidegui(line):
+  drawgui(line)
+
+
+def drawslide(line):
+  return draw(line)
+
+
+cell_magics = [inline_math, block_math, tikz, tikzfig, tikzfigwide,
+               algorithm, drawfig, drawwide, drawfiggui]
+line_magics = [draw, drawgui, drawslidegui, drawslide]
+
+
+def load_ipython_extension(ipython):
+  for magic in cell_magics:
+    ipython.register_magic_function(magic, "cell")
+  for magic in line_magics:
+    ipython.register_magic_function(magic, "line")
+
+
+def launch_draw_gui(content, filename=None):
+  import tkinter as tk
+  import english2tikz
+  screen_width, screen_height = 1200, 750
+  data = json.loads(content)
+  root = tk.Tk()
+  canvas = tk.Canvas(root, bg="white", width=screen_width,
+                     height=screen_height)
+  canvas.pack()
+
+  editor = english2tikz.Editor(root, canvas, screen_width, screen_height)
+  editor.load(data)
+  editor.filename = filename
+
+  root.title("Vim Draw")
+  root.minsize(screen_width, screen_height)
+  root.configure(bg="white")
+  root.mainloop()
@@ -1,10 +1,16 @@
 import string
 import re
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+from collections import OrderedDict, namedtuple
+from juptex import tracing
 from juptex.config import *
 from juptex.errors import *
 from juptex.notebook import *
 from juptex.preview import *
 from juptex.utils import *
+from juptex.namespace import Namespace
 
 
 greek_letters = [
@@ -25,6 +31,55 @@ tokens = {
 }
 
 
+token_pattern = re.compile("|".join(
+    [f"(?P<{label}>{token})" for label, token in tokens.items()] +
+    ["(?P<Char>.)"]), re.DOTALL)
+
+
+font_commands = [
+    ("rm", "rm", r"\mathrm"),
+    ("bb", "bb", r"\mathbb"),
+    ("bf", "bf", r"\mathbf"),
+    ("c", "cal", r"\mathcal"),
+    ("sf", "sf", r"\mathsf"),
+    ("tt", "tt", r"\mathtt"),
+    ("bd", "bd", r"\boldsymbol"),
+]
+
+
+@lru_cache(maxsize=None)
+def common_definitions():
+  """
+  The built-in macros, built once on first use and shared read-only by
+  every MathManager underneath its own definitions.
+  """
+  ret = {
+      "paren": lambda v: r"\left(%s\right)" % v,
+      "bracket": lambda v: r"\left[%s\right]" % v,
+      "brace": lambda v: r"\left\{%s\right\}" % v,
+      "vecsub": lambda a, b: r"\vec{%s}_{[%s]}" % (a, b),
+      "isequal": r"\stackrel{?}{=}",
+      "sample": r"\stackrel{\$}{\gets}",
+  }
+  for a in string.ascii_uppercase:
+    for prefix, _, command in font_commands:
+      ret[f"{prefix}{a}"] = "%s{%s}" % (command, a)
+  for a in string.ascii_lowercase:
+    for prefix, _, command in font_commands:
+      ret[f"{prefix}_{a}"] = "%s{%s}" % (command, a)
+  for g in greek_letters:
+    ret[g] = "\\" + g
+    g = g.capitalize()
+    ret[g] = "\\" + g
+    for _, prefix, command in font_commands:
+      ret[f"{prefix}{g}"] = "%s{\\%s}" % (command, g)
+  return MappingProxyType(ret)
+
+
+MathCacheInfo = namedtuple("MathCacheInfo",
+                           ["hits", "misses", "maxsize", "currsize"])
+
+
 class Command(object):
   def __init__(self, name):
     self._name = name
@@ -36,10 +91,13 @@ class Command(object):
 
 class Raw(object):
   def __init__(self):
-    self._content = ""
+    self._content = []
 
   def append(self, text):
-    self._content += text
+    self._content.append(text)
+
+  def content(self):
+    return "".join(self._content)
 
 
 class MathManager(object):
@@ -49,10 +107,14 @@ class MathManager(object):
     self._line_splitter = line_splitter
     self._space_holder = space_holder
     self._indent = math_indent
-    self._locals = {}
+    self._locals = Namespace(common_definitions())
     self._equation_name = None
     self._meta = []
-    self.common_definitions()
+    self._cache = OrderedDict()
+    self._cache_size = math_cache_size
+    self._cache_hits = 0
+    self._cache_misses = 0
+    self._cache_lock = threading.Lock()
     self.define_define_functions()
 
   def get(self, key):
@@ -162,41 +224,6 @@ class MathManager(object):
     else:
       self.define(content, r"\boldsymbol{%s}" % content)
 
-  def common_definitions(self):
-    self.define("paren", lambda v: r"\left(%s\right)" % v)
-    self.define("bracket", lambda v: r"\left[%s\right]" % v)
-    self.define("brace", lambda v: r"\left\{%s\right\}" % v)
-    self.define("vecsub", lambda a, b: r"\vec{%s}_{[%s]}" % (a, b))
-    self.define("isequal", r"\stackrel{?}{=}")
-    self.define("sample", r"\stackrel{\$}{\gets}")
-    for a in list(string.ascii_uppercase):
-      self.define_rm(a, f"rm{a}")
-      self.define_bb(a, f"bb{a}")
-      self.define_bf(a, f"bf{a}")
-      self.define_cal(a, f"c{a}")
-      self.define_sf(a, f"sf{a}")
-      self.define_tt(a, f"tt{a}")
-      self.define_bd(a, f"bd{a}")
-    for a in list(string.ascii_lowercase):
-      self.define_rm(a, f"rm_{a}")
-      self.define_bb(a, f"bb_{a}")
-      self.define_bf(a, f"bf_{a}")
-      self.define_cal(a, f"c_{a}")
-      self.define_sf(a, f"sf_{a}")
-      self.define_tt(a, f"tt_{a}")
-      self.define_bd(a, f"bd_{a}")
-    for g in greek_letters:
-      self.define(g, "\\"+g)
-      g = g.capitalize()
-      self.define(g, "\\"+g)
-      self.define_rm("\\"+g, f"rm{g}")
-      self.define_bb("\\"+g, f"bb{g}")
-      self.define_bf("\\"+g, f"bf{g}")
-      self.define_cal("\\"+g, f"cal{g}")
-      self.define_sf("\\"+g, f"sf{g}")
-      self.define_tt("\\"+g, f"tt{g}")
-      self.define_bd("\\"+g, f"bd{g}")
-
   def common_definitions_for_crypto(self):
     self.define("field", self.get("bbF"))
     self.define("ffv", lambda e: self(r"\field^{%s}" % e))
@@ -211,8 +238,63 @@ class MathManager(object):
     self.define("instance", r"\mathbbm{x}")
     self.define("witness", r"\mathbbm{w}")
 
+  @tracing.traced("math")
   def __call__(self, content):
-    return self.transpile(self.preprocess(self.parse(content)))
+    if not self._cacheable(content):
+      return self.transpile(self.preprocess(self.parse(content)))
+    """
+    Any change to the definitions increases the generation, so results
+    compiled under older definitions are never returned, and simply fall
+    out of the cache. The cache is shared by the preview threads, so it is
+    only touched under the lock, but the equation is compiled outside it.
+    """
+    key = (content, self._locals.generation)
+    with self._cache_lock:
+      if key in self._cache:
+        self._cache_hits += 1
+        self._cache.move_to_end(key)
+        ret = self._cache[key]
+      else:
+        self._cache_misses += 1
+        ret = None
+    if ret is not None:
+      tracing.count("math_cache.hits")
+      return ret
+    tracing.count("math_cache.misses")
+    ret = self.transpile(self.preprocess(self.parse(content)))
+    with self._cache_lock:
+      self._cache[key] = ret
+      self._cache.move_to_end(key)
+      while len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+    return ret
+
+  def _cacheable(self, content):
+    """
+    Python lines may evaluate to something different every time, and
+    instructions have side effects, so equations with them are always
+    compiled.
+    """
+    if self._cache_size <= 0:
+      return False
+    for line in content.split("\n"):
+      for part in line.split(self._line_splitter):
+        part = part.strip()
+        if (part.startswith(self._python_mark) or
+            part.startswith(self._instruction_mark)):
+          return False
+    return True
+
+  def cache_info(self):
+    with self._cache_lock:
+      return MathCacheInfo(self._cache_hits, self._cache_misses,
+                           self._cache_size, len(self._cache))
+
+  def clear_cache(self):
+    with self._cache_lock:
+      self._cache.clear()
+      self._cache_hits = 0
+      self._cache_misses = 0
 
   def view(self, content, env):
     if isnotebook():
@@ -285,7 +367,7 @@ class MathManager(object):
     if line.startswith(self._python_mark):
       code = line[len(self._python_mark):]
       try:
-        line = str(eval(code, self._locals if self._locals else {}))
+        line = str(eval(compile_expression(code), self._locals.scope()))
       except Exception as e:
         raise e
       return [(level, line)]
@@ -319,19 +401,20 @@ class MathManager(object):
 
     return self.post_process("".join(ret))
 
-  def tokenize(self, line):
-    if len(line) == 0:
-      return "End", "", ""
-    for label, token in tokens.items():
-      match = re.match(token, line)
-      if match:
-        return label, match.group(0), line[match.span()[1]:]
-    return "Char", line[0], line[1:]
+  def tokenize(self, line, pos):
+    """
+    Return the label and the text of the token starting at pos, and the
+    position right after it. The line itself is never copied.
+    """
+    if pos >= len(line):
+      return "End", "", pos
+    match = token_pattern.match(line, pos)
+    return match.lastgroup, match.group(), match.end()
 
   def post_process(self, line):
     line = line.replace(self._space_holder, " ")
     stack, mode = [Raw()], "normal"
-    label, token, line = self.tokenize(line)
+    label, token, pos = self.tokenize(line, 0)
     while True:
       if mode == "normal":
         """
@@ -346,7 +429,7 @@ class MathManager(object):
         elif label == "OpenBrace":
           stack.append(Raw())
         elif label == "CloseBrace":
-          last = stack[-1]._content
+          last = stack[-1].content()
           stack.pop()
           if len(stack) == 0:
             raise MathEquationError("Extra }")
@@ -358,7 +441,7 @@ class MathManager(object):
         elif label == "End":
           if len(stack) > 1:
             raise MathEquationError("Unexpected End, expecting '}'")
-          return stack[0]._content
+          return stack[0].content()
         else:
           raise ValueError(f"Unknown label {label}")
       elif mode == "expect open":
@@ -408,4 +491,4 @@ class MathManager(object):
       else:
         raise ValueError(f"Impossible mode {mode}")
 
-      label, token, line = self.tokenize(line)
+      label, token, pos = self.tokenize(line, pos)
@@ -0,0 +1,82 @@
+class Namespace(dict):
+  """
+  The definitions shared by the managers.
+
+  Every modification increases the generation, so that anything computed
+  from the definitions can tell whether it is still up to date.
+
+  Keys that are not defined fall back to the read-only defaults, which may
+  be shared by many namespaces. Iterating, len() and pickling only see the
+  definitions made in this namespace.
+  """
+
+  generation = 0
+  _defaults = {}
+  _scope = None
+  _scope_generation = None
+
+  def __init__(self, defaults=None):
+    super().__init__()
+    if defaults is not None:
+      self._defaults = defaults
+
+  def __missing__(self, key):
+    return self._defaults[key]
+
+  def __contains__(self, key):
+    return super().__contains__(key) or key in self._defaults
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+  def scope(self):
+    """
+    A plain dict with the defaults and the definitions, for eval() which
+    requires globals to be a dict and looks them up without __missing__.
+    It is rebuilt only when the definitions change.
+    """
+    if self._scope is None or self._scope_generation != self.generation:
+      self._scope = {**self._defaults, **self}
+      self._scope_generation = self.generation
+    return self._scope
+
+  def __setitem__(self, key, value):
+    super().__setitem__(key, value)
+    self.generation += 1
+
+  def __delitem__(self, key):
+    super().__delitem__(key)
+    self.generation += 1
+
+  def update(self, *args, **kwargs):
+    super().update(*args, **kwargs)
+    self.generation += 1
+
+  def setdefault(self, key, default=None):
+    """
+    A key that is only in the defaults is already set, so the default is
+    neither inserted nor returned.
+    """
+    if key in self:
+      return self[key]
+    self[key] = default
+    return default
+
+  def __reduce__(self):
+    """
+    The defaults, which may be a read-only mappingproxy, and the cached
+    scope are left out of the pickle.
+    """
+    return type(self), (), None, None, iter(dict.items(self))
+
+  def pop(self, *args):
+    self.generation += 1
+    return super().pop(*args)
+
+  def popitem(self):
+    self.generation += 1
+    return super().popitem()
+
+  def clear(self):
+    super().clear()
+    self.generation += 1
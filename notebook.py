@@ -15,18 +15,50 @@ def isnotebook():
 
 
 if isnotebook():
-  from IPython.display import Image
+  from IPython.display import Image, SVG, Markdown, display
   from IPython.core.magic import register_cell_magic, register_line_magic
 else:
   Image = None
+  SVG = None
+  Markdown = None
+  display = None
   register_cell_magic = None
   register_line_magic = None
 
 
 def get_cells(notebook):
-  with open(f"{notebook}.ipynb") as f:
-    data = json.load(f)
-  cells = data["cells"]
-  cells = [(cell["cell_type"], "".join(cell["source"])) for cell in cells
-           if cell["cell_type"] in ["code", "markdown"]]
-  return cells
+  return [(type_, source) for _, type_, source in iter_cells(notebook)]
+
+
+def iter_cells(notebook):
+  """
+  Yield the index in the notebook, the type and the source of the code and
+  markdown cells one by one. The index counts the cells that are skipped,
+  so that it is the number of the cell shown in the notebook.
+
+  With ijson installed, the notebook is parsed as a stream of events and
+  the outputs of the code cells, e.g. embedded previews, are skipped
+  without being built into Python objects.
+  """
+  try:
+    import ijson
+  except ImportError:
+    with open(f"{notebook}.ipynb") as f:
+      data = json.load(f)
+    for index, cell in enumerate(data["cells"]):
+      if cell["cell_type"] in ["code", "markdown"]:
+        yield index, cell["cell_type"], "".join(cell["source"])
+    return
+
+  with open(f"{notebook}.ipynb", "rb") as f:
+    index, cell_type, source = 0, None, []
+    for prefix, event, value in ijson.parse(f):
+      if prefix == "cells.item.cell_type":
+        cell_type = value
+      elif (prefix in ["cells.item.source", "cells.item.source.item"] and
+            event == "string"):
+        source.append(value)
+      elif prefix == "cells.item" and event == "end_map":
+        if cell_type in ["code", "markdown"]:
+          yield index, cell_type, "".join(source)
+        index, cell_type, source = index + 1, None, []
@@ -1,35 +1,75 @@
 import os
-from juptex.notebook import isnotebook, Image
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from juptex.notebook import isnotebook, Image, SVG, Markdown, display
+from juptex import tracing
 from juptex.config import *
+from juptex.cache import FileCache
 
 
-def genpdf(content, meta=None, clean=False, postfix=""):
+preview_cache = FileCache(preview_cache_path, preview_cache_size)
+preview_executor = None
+preview_jobs = {}
+preview_jobs_lock = threading.Lock()
+format_lock = threading.Lock()
+failed_formats = set()
+preview_format_timings = {}
+preview_timings = deque(maxlen=1000)
+
+
+def genpdf(content, meta=None, clean=False, postfix="", workdir="./view"):
   original_content = content
   content = enclose_with_template(content, meta)
   has_reference = need_reference(content)
-  if not os.path.isdir("./view"):
-    os.mkdir("view")
+  if not os.path.isdir(workdir):
+    os.mkdir(workdir)
   if clean:
-    ret = os.system(f"cd view && rm -rf view*")
+    ret = os.system(f"cd '{workdir}' && rm -rf view*")
     if ret != 0:
       print(f"Exit with error: {ret}")
       return False
-  with open(f"./view/view{postfix}.tex", "w") as f:
+  with open(os.path.join(workdir, f"view{postfix}.tex"), "w") as f:
     f.write(content)
   if has_reference:
-    ret = os.system(f"cp {bib_path} ./view")
+    ret = os.system(f"cp {bib_path} '{workdir}'")
     if ret != 0:
       print(f"Exit with error: {ret}")
       return False
-    ret = os.system("cd view && latexmk -pdf -halt-on-error -silent "
+    ret = os.system(f"cd '{workdir}' && latexmk -pdf -halt-on-error -silent "
                     "> /dev/null 2> error.log")
   else:
-    ret = os.system(f"cd view && pdflatex view{postfix}.tex "
-                    "-halt-on-error -silent "
-                    "> /dev/null 2> error.log")
+    fmt = (ensure_format(content[:content.find("\\begin{document}")])
+           if preview_backend == "format" else None)
+    start = time.perf_counter()
+    if fmt is not None:
+      ret = os.system(f"cd '{workdir}' && TEXFORMATS='{format_path}:' "
+                      f"pdflatex -fmt={fmt} view{postfix}.tex "
+                      "-halt-on-error -silent "
+                      "> /dev/null 2> error.log")
+      if ret != 0:
+        """
+        The format may be stale, e.g. after TeX Live or a package in the
+        preamble is updated, so it is discarded and the snippet compiled
+        without it.
+        """
+        discard_format(fmt)
+        fmt = None
+    if fmt is None:
+      ret = os.system(f"cd '{workdir}' && pdflatex view{postfix}.tex "
+                      "-halt-on-error -silent "
+                      "> /dev/null 2> error.log")
+    preview_timings.append({
+        "format": fmt,
+        "compile": time.perf_counter() - start,
+    })
   if ret != 0:
     print(f"Exit with error: {ret}")
-    with open("./view/view.log") as f:
+    with open(os.path.join(workdir, "view.log")) as f:
       message = f.read()
       key_message_location = max(message.find("Emergency")-100, 0)
       print(message[key_message_location:
@@ -40,6 +80,69 @@ def genpdf(content, meta=None, clean=False, postfix=""):
   return True
 
 
+def ensure_format(preamble):
+  """
+  Return the name of a format with the preamble already loaded, dumping
+  it with mylatexformat the first time the preamble is seen, or None if
+  the preamble cannot be dumped. A snippet compiled against the format
+  skips its own preamble up to \\begin{document}.
+  """
+  name = "juptex-" + hashlib.sha256(preamble.encode()).hexdigest()[:16]
+  with format_lock:
+    if name in failed_formats:
+      return None
+    if os.path.exists(os.path.join(format_path, name + ".fmt")):
+      return name
+    os.makedirs(format_path, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="juptex-format-")
+    try:
+      with open(os.path.join(workdir, name + ".tex"), "w") as f:
+        f.write(preamble + "\\begin{document}\n\\end{document}\n")
+      start = time.perf_counter()
+      ret = os.system(f"cd '{workdir}' && pdflatex -ini -jobname={name} "
+                      f"'&pdflatex' mylatexformat.ltx '{name}.tex' "
+                      "> /dev/null 2> /dev/null")
+      preview_format_timings[name] = time.perf_counter() - start
+      if ret != 0:
+        failed_formats.add(name)
+        return None
+      os.replace(os.path.join(workdir, name + ".fmt"),
+                 os.path.join(format_path, name + ".fmt"))
+      return name
+    finally:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+
+def discard_format(name):
+  """
+  Never use the format again in this session, and remove it so that the
+  next session dumps it again.
+  """
+  with format_lock:
+    failed_formats.add(name)
+    try:
+      os.remove(os.path.join(format_path, name + ".fmt"))
+    except OSError:
+      pass
+
+
+def preview_timing_report():
+  """
+  Compare the time spent on dumping formats with the time spent on
+  compiling snippets, with and without a format.
+  """
+  lines = []
+  for name, seconds in preview_format_timings.items():
+    lines.append(f"dump {name}: {seconds:.3f}s")
+  for backend in ["format", "plain"]:
+    timings = [t["compile"] for t in preview_timings
+               if (t["format"] is not None) == (backend == "format")]
+    if len(timings) > 0:
+      lines.append(f"compile with {backend}: {len(timings)} snippets, "
+                   f"{sum(timings) / len(timings):.3f}s on average")
+  return "\n".join(lines)
+
+
 def need_reference(content):
   return content.find("\\cite{") >= 0
 
@@ -67,30 +170,179 @@ def enclose_with_template(content, meta=None):
 
 
 def genpng(content, meta=None, crop=True):
-  if not genpdf(content, meta):
+  if preview_workers > 0 and isnotebook():
+    return display_when_done(submit_preview(content, meta, crop))
+
+  key = preview_key(content, meta, crop)
+  path = preview_cache.get(key)
+  tracing.count("preview_cache.hits" if path is not None
+                else "preview_cache.misses")
+  if path is None:
+    path = preview_cache.put(key, render_preview(content, meta, crop))
+
+  if isnotebook():
+    return preview_object(path)
+  else:
+    os.system(f"open '{path}'")
+
+
+@tracing.traced("render_preview")
+def render_preview(content, meta=None, crop=True, workdir="./view"):
+  if not genpdf(content, meta, workdir=workdir):
     raise Exception("Failed to generate pdf")
 
+  pdf = os.path.join(workdir, "view.pdf")
+  output = os.path.join(workdir, "view." + preview_format)
+  try:
+    rasterize(pdf, output, crop)
+  except ImportError:
+    convert_with_tools(pdf, output, crop)
+  return output
+
+
+def rasterize(pdf, output, crop=True):
+  """
+  Crop the first page of the pdf to the bounding box of what is drawn on
+  it, and render it at preview_dpi, or as SVG, in one step.
+  """
+  import pymupdf
+  with pymupdf.open(pdf) as doc:
+    page = doc[0]
+    rect = page.rect
+    if crop:
+      bbox = pymupdf.Rect()
+      for _, r in page.get_bboxlog():
+        bbox |= pymupdf.Rect(r)
+      if not bbox.is_empty:
+        rect = bbox & page.rect
+    if preview_format == "svg":
+      page.set_cropbox(rect)
+      with open(output, "w") as f:
+        f.write(page.get_svg_image())
+    else:
+      page.get_pixmap(dpi=preview_dpi, clip=rect, alpha=False).save(output)
+
+
+def convert_with_tools(pdf, output, crop=True):
   if crop:
-    ret = os.system("pdfcrop ./view/view.pdf ./view/view-crop.pdf "
+    cropped = pdf[:-4] + "-crop.pdf"
+    ret = os.system(f"pdfcrop '{pdf}' '{cropped}' "
                     "1> /dev/null 2> /dev/null")
     if ret != 0:
       raise Exception(f"pdfcrop exit with error: {ret}")
+    pdf = cropped
 
-    ret = os.system(
-        "convert -density 600 ./view/view-crop.pdf "
-        "./view/view.png 2> /dev/null")
-    if ret != 0:
-      raise Exception(f"Convert exit with error: {ret}")
+  if preview_format == "svg":
+    ret = os.system(f"pdf2svg '{pdf}' '{output}' 2> /dev/null")
   else:
     ret = os.system(
-        "convert -density 600 ./view/view.pdf ./view/view.png 2> /dev/null")
-    if ret != 0:
-      raise Exception(f"Convert exit with error: {ret}")
+        f"convert -density {preview_dpi} '{pdf}' '{output}' 2> /dev/null")
+  if ret != 0:
+    raise Exception(f"Convert exit with error: {ret}")
 
-  if isnotebook():
-    return Image("./view/view.png")
-  else:
-    os.system("open ./view/view.png")
+
+def preview_object(path=None, data=None):
+  if preview_format == "svg":
+    return SVG(filename=path, data=data)
+  return Image(filename=path, data=data)
+
+
+def submit_preview(content, meta=None, crop=True):
+  """
+  Render the preview in the background, in a working directory of its own,
+  and return a Future of the image data. The same preview asked for again
+  while it is rendered shares the same Future.
+  """
+  key = preview_key(content, meta, crop)
+  path = preview_cache.get(key)
+  tracing.count("preview_cache.hits" if path is not None
+                else "preview_cache.misses")
+  if path is not None:
+    future = Future()
+    with open(path, "rb") as f:
+      future.set_result(f.read())
+    return future
+  with preview_jobs_lock:
+    future = preview_jobs.get(key)
+    if future is not None:
+      return future
+    future = get_preview_executor().submit(render_preview_job, key, content,
+                                           meta, crop)
+    preview_jobs[key] = future
+  future.add_done_callback(lambda future: forget_preview_job(key, future))
+  return future
+
+
+def forget_preview_job(key, future):
+  with preview_jobs_lock:
+    if preview_jobs.get(key) is future:
+      del preview_jobs[key]
+
+
+def render_preview_job(key, content, meta, crop):
+  """
+  The image is read from the working directory rather than from the
+  cache, where another job may already have evicted it.
+  """
+  workdir = tempfile.mkdtemp(prefix="juptex-view-")
+  try:
+    output = render_preview(content, meta, crop, workdir)
+    preview_cache.put(key, output)
+    with open(output, "rb") as f:
+      return f.read()
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def get_preview_executor():
+  """
+  The jobs spend their time waiting on pdflatex, pdfcrop and convert,
+  so a pool of threads is enough to keep that many processes busy.
+  """
+  global preview_executor
+  if preview_executor is None:
+    preview_executor = ThreadPoolExecutor(max_workers=max(1, preview_workers))
+  return preview_executor
+
+
+def display_when_done(future):
+  """
+  Show a placeholder in the notebook, and replace it with the preview
+  once the future is resolved.
+  """
+  handle = display(Markdown("*Rendering...*"), display_id=True)
+
+  def update(future):
+    try:
+      handle.update(preview_object(data=future.result()))
+    except Exception as e:
+      handle.update(Markdown(f"*Failed to render: {e}*"))
+
+  future.add_done_callback(update)
+
+
+def preview_key(content, meta=None, crop=True):
+  """
+  The key of a preview in the cache is the complete LaTeX source, and the
+  bibliography if the source cites anything.
+  """
+  source = enclose_with_template(content, meta)
+  bibliography = ""
+  if need_reference(source) and os.path.exists(bib_path):
+    stat = os.stat(bib_path)
+    bibliography = f"{stat.st_mtime_ns}:{stat.st_size}"
+  return "%s.%s" % (
+      preview_cache.key(source, bibliography, "crop" if crop else "",
+                        str(preview_dpi)),
+      preview_format)
+
+
+def preview_cache_info():
+  return preview_cache.info()
+
+
+def clear_preview_cache():
+  preview_cache.clear()
 
 
 tikz_code = r"""
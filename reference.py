@@ -1,33 +1,174 @@
+import os
 import re
-from pybtex.database import parse_file, BibliographyData
+import pickle
+from juptex import tracing
 from juptex.config import *
+from juptex.cache import write_if_changed
+
+
+citation_pattern = re.compile(
+    r"\\cite[pt]?\*?(?:\[[^\]]*\]){0,2}\{([^{}]*)\}")
+
+
+def find_citations(content):
+  for match in citation_pattern.finditer(content):
+    for key in match.group(1).split(","):
+      key = key.strip()
+      if key != "":
+        yield key
 
 
 class Reference(object):
-  def __init__(self):
-    self.database = parse_file(bib_path)
+  def __init__(self, database=None):
+    from pybtex.database import BibliographyData
+    self.database = database if database is not None else BibIndex()
     self.filtered_database = BibliographyData()
 
   def extract_citations(self, content):
-    while True:
-      match = re.search(r"\\cite\{([\w\-]+(:?,\s*[\w\-]+)*)\}", content)
-      if match:
-        key = match.group(1)
-        keys = key.split(',')
-        for key in keys:
-          key = key.strip()
-          if key not in self.database.entries:
-            raise Exception(f"Unfound citation: {key}")
-          entry = self.database.entries[key]
-          for field in reference_entry_black_list:
-            if field in entry.fields:
-              del entry.fields[field]
-          self.filtered_database.entries[key] = entry
-        content = content[match.span()[1]:]
-      else:
-        break
+    self.add_citations(find_citations(content))
+
+  @tracing.traced("add_citations")
+  def add_citations(self, keys):
+    keys = list(keys)
+    if isinstance(self.database, BibIndex):
+      self.database.load(keys)
+    for key in keys:
+      self.add_citation(key)
+
+  def add_citation(self, key):
+    if key in self.filtered_database.entries:
+      return
+    if key not in self.database:
+      raise Exception(f"Unfound citation: {key}")
+    entry = self.database[key]
+    for field in reference_entry_black_list:
+      if field in entry.fields:
+        del entry.fields[field]
+    self.filtered_database.entries[key] = entry
 
+  @tracing.traced("dump_reference")
   def dump(self, path):
     if len(self.filtered_database.entries) > 0:
-      with open(path, "w") as f:
-        self.filtered_database.to_file(f)
+      write_if_changed(path, self.filtered_database.to_string("bibtex"))
+
+
+class BibIndex(object):
+  """
+  Look up the entries of a bib file by key without parsing the whole file.
+
+  The raw text of every entry is indexed by its key, and the index is
+  pickled next to the bib file, so it is only rebuilt when the modification
+  time or the size of the bib file changes. Only the entries that are
+  looked up are parsed by pybtex.
+  """
+
+  version = 1
+
+  def __init__(self, path=None):
+    self._path = path if path is not None else bib_path
+    self._index_path = self._path + ".index"
+    self._entries = {}
+    stat = os.stat(self._path)
+    signature = (self.version, stat.st_mtime_ns, stat.st_size)
+    if os.path.exists(self._index_path):
+      try:
+        with open(self._index_path, "rb") as f:
+          data = pickle.load(f)
+        if data["signature"] == signature:
+          self._raw, self._macros = data["raw"], data["macros"]
+          tracing.count("bib_index.hits")
+          return
+      except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+    tracing.count("bib_index.builds")
+    with tracing.span("index_bibtex"), open(self._path) as f:
+      self._raw, self._macros = index_bibtex(f.read())
+    try:
+      with open(self._index_path, "wb") as f:
+        pickle.dump({
+            "signature": signature,
+            "raw": self._raw,
+            "macros": self._macros,
+        }, f, pickle.HIGHEST_PROTOCOL)
+    except OSError:
+      pass
+
+  def __contains__(self, key):
+    return key.lower() in self._raw
+
+  def __getitem__(self, key):
+    key = key.lower()
+    if key not in self._entries:
+      from pybtex.database import parse_string
+      database = parse_string(self._macros + "\n" + self._raw[key], "bibtex")
+      self._entries[key] = next(iter(database.entries.values()))
+    return self._entries[key]
+
+  def __len__(self):
+    return len(self._raw)
+
+  @tracing.traced("load_bib")
+  def load(self, keys):
+    """
+    Parse the entries of the keys that are not parsed yet all at once,
+    which is much faster than parsing them one by one.
+    """
+    keys = [key.lower() for key in keys]
+    keys = [key for key in dict.fromkeys(keys)
+            if key in self._raw and key not in self._entries]
+    if len(keys) == 0:
+      return
+    from pybtex.database import parse_string
+    database = parse_string(
+        self._macros + "\n" + "\n".join(self._raw[key] for key in keys),
+        "bibtex")
+    for key, entry in database.entries.items():
+      self._entries[key.lower()] = entry
+
+
+entry_start_pattern = re.compile(r"@\s*(\w+)\s*([{(])")
+brace_pattern = re.compile(r"[{}]")
+brace_paren_pattern = re.compile(r"[{}()]")
+
+
+def index_bibtex(content):
+  """
+  Split the content of a bib file into a map from the lowercased key to the
+  raw text of each entry, and the text of the @string and @preamble
+  commands that the entries may depend on.
+  """
+  raw, macros = {}, []
+  pos = 0
+  while True:
+    match = entry_start_pattern.search(content, pos)
+    if not match:
+      break
+    start = match.start()
+    end = find_closing(content, match.end(), match.group(2))
+    if end is None:
+      break
+    pos = end
+    kind = match.group(1).lower()
+    if kind in ["string", "preamble"]:
+      macros.append(content[start:end])
+    elif kind != "comment":
+      body = content[match.end():end]
+      key = body[:body.find(",")].strip() if body.find(",") >= 0 else ""
+      if key != "" and key.lower() not in raw:
+        raw[key.lower()] = content[start:end]
+  return raw, "\n".join(macros)
+
+
+def find_closing(content, start, opening):
+  pattern = brace_pattern if opening == "{" else brace_paren_pattern
+  depth = 1
+  match = pattern.search(content, start)
+  while match:
+    if match.group() in ["{", "("]:
+      depth += 1
+    else:
+      depth -= 1
+      if depth == 0:
+        return match.end()
+    match = pattern.search(content, match.end())
+  return None
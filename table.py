@@ -1,5 +1,7 @@
 import os
-from numbers_parser import Document, TextCell, NumberCell
+import pickle
+import hashlib
+from juptex import tracing
 from juptex.config import *
 from juptex.text import TextManager
 from juptex.utils import *
@@ -369,35 +371,32 @@ class TableManager(object):
   def read(self, name):
     if name.endswith(".numbers"):
       tabulars = []
-      doc = Document(name)
-      sheets = doc.sheets
-      tables = sheets[0].tables
       self.name = name
-      for table in tables:
+      for rows in read_numbers(name):
         latex_table = Table(name)
-        rows = tables[0].rows()
         column_ids = rows[0]
         data = rows[1:]
         m, n = len(data), len(data[0])
-        latex_table.set_columns([item.value.strip() for item in column_ids])
+        latex_table.set_columns([value.strip() for _, value, _ in column_ids])
         for i in range(m):
           sentences = []
-          for j in range(n):
-            if isinstance(data[i][j], TextCell):
-              sentences.append(self._text_manager(data[i][j].value.strip()))
-            elif isinstance(data[i][j], NumberCell):
-              sentences.append("%g" % (data[i][j].value))
+          for kind, value, _ in data[i]:
+            if kind == "text":
+              sentences.append(self._text_manager(value.strip()))
+            elif kind == "number":
+              sentences.append("%g" % value)
             else:
               sentences.append(None)
-          row = [str(item.value).strip()
-                 if item.value is not None
+          row = [str(value).strip()
+                 if value is not None
                  else None
-                 for item in data[i]]
+                 for _, value, _ in data[i]]
           latex_table.add_row(row, sentences)
           for j in range(n):
-            if isinstance(data[i][j], TextCell):
-              latex_table.get_row(i)._cells[j].row_span(data[i][j].size[0])
-              latex_table.get_row(i)._cells[j].col_span(data[i][j].size[1])
+            kind, _, size = data[i][j]
+            if kind == "text":
+              latex_table.get_row(i)._cells[j].row_span(size[0])
+              latex_table.get_row(i)._cells[j].col_span(size[1])
         tabulars.append(latex_table)
       return tabulars
     else:
@@ -415,3 +414,81 @@ class TableManager(object):
                label,
                "\n\n".join([tab.dump_tabular() for tab in tabulars]),
                env_name)
+
+
+numbers_cache_version = 1
+
+
+def read_numbers(name, path=None):
+  """
+  The tables of the first sheet of a Numbers file, each a list of rows of
+  (kind, value, size) for every cell, where kind is "text", "number" or
+  None, and size is the span of a text cell.
+
+  The tables are pickled in the table cache under the hash of the path of
+  the file, and only extracted again when the modification time or the
+  size of the file changes.
+  """
+  cache = os.path.join(
+      path if path is not None else table_cache_path,
+      hashlib.sha256(os.path.abspath(name).encode()).hexdigest() + ".pickle")
+  signature = (numbers_cache_version,) + file_signature(name)
+  if os.path.exists(cache):
+    try:
+      with open(cache, "rb") as f:
+        data = pickle.load(f)
+      if data["signature"] == signature:
+        tracing.count("table_cache.hits")
+        return data["tables"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+      pass
+  tracing.count("table_cache.misses")
+  tables = extract_numbers(name)
+  try:
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    with open(cache + ".tmp", "wb") as f:
+      pickle.dump({"signature": signature, "tables": tables}, f,
+                  pickle.HIGHEST_PROTOCOL)
+    os.replace(cache + ".tmp", cache)
+  except OSError:
+    pass
+  return tables
+
+
+def file_signature(name):
+  """
+  A Numbers file may also be a package, i.e. a directory, in which case
+  the latest modification time and the total size of its files are used.
+  """
+  if not os.path.isdir(name):
+    stat = os.stat(name)
+    return (stat.st_mtime_ns, stat.st_size)
+  mtime, size = os.stat(name).st_mtime_ns, 0
+  for root, _, files in os.walk(name):
+    for file in files:
+      stat = os.stat(os.path.join(root, file))
+      mtime, size = max(mtime, stat.st_mtime_ns), size + stat.st_size
+  return (mtime, size)
+
+
+@tracing.traced("extract_numbers")
+def extract_numbers(name):
+  """
+  Read the rows of every table exactly once.
+  """
+  from numbers_parser import Document, TextCell, NumberCell
+  ret = []
+  for table in Document(name).sheets[0].tables:
+    rows = []
+    for row in table.rows():
+      cells = []
+      for item in row:
+        if isinstance(item, TextCell):
+          cells.append(("text", item.value, item.size))
+        elif isinstance(item, NumberCell):
+          cells.append(("number", item.value, None))
+        else:
+          cells.append((None, item.value, None))
+      rows.append(cells)
+    ret.append(rows)
+  return ret
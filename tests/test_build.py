@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import unittest
+from juptex.build import *
+
+
+log = r"""
+(./body.tex
+./body.tex:7: Undefined control sequence.
+l.7 Let $\bbF
+            $ be a field.
+./appendix.tex:1: Missing $ inserted.
+<inserted text>
+l.1 x_
+"""
+
+
+class TestBuild(unittest.TestCase):
+  def test_parse_log(self):
+    source_map = {"body.tex": [(1, 0), (3, 2), (6, 5)]}
+    errors = parse_log(log, source_map)
+    self.assertEqual(len(errors), 2)
+    self.assertEqual(errors[0], LatexError(
+        "./body.tex", 7, "Undefined control sequence.", r"Let $\bbF", 5))
+    self.assertEqual(errors[1].context, "x_")
+    self.assertIsNone(errors[1].cell)
+    self.assertEqual(parse_log("! Emergency stop.\n")[0].message,
+                     "Emergency stop.")
+
+  def test_coalesce(self):
+    with tempfile.TemporaryDirectory() as path:
+      script = ("import time\n"
+                "time.sleep(0.3)\n"
+                "open('runs', 'a').write('x')\n"
+                "open('main.log', 'w').write('./body.tex:2: Oops.')\n")
+      manager = BuildManager(command=[sys.executable, "-c", script])
+      first = manager.submit(path)
+      second = manager.submit(path)
+      third = manager.submit(path, {"body.tex": [(1, 4)]})
+      self.assertIsNot(first, second)
+      self.assertIs(second, third)
+      self.assertEqual(first.result().returncode, 0)
+      self.assertEqual(third.result().errors[0].cell, 4)
+      manager.shutdown()
+      with open(os.path.join(path, "runs")) as f:
+        self.assertEqual(f.read(), "xx")
+      self.assertEqual(len(manager.timings), 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
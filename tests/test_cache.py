@@ -0,0 +1,174 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from juptex.cache import *
+
+
+class TestBuildCache(unittest.TestCase):
+  def test_fingerprint(self):
+    with tempfile.TemporaryDirectory() as path:
+      cache = BuildCache("paper", path)
+      cell = {"type": "text", "content": r"Value of $\field$ is `sec_intro`."}
+      definitions = {
+          "field": r"\bbF",
+          "bbF": r"\mathbb{F}",
+          "sec_intro": r"Section~\ref{sec:intro}",
+          "unused": "A",
+      }
+      key = cache.fingerprint(cell, definitions)
+      definitions["unused"] = "B"
+      self.assertEqual(cache.fingerprint(cell, definitions), key)
+      definitions["bbF"] = r"\mathbf{F}"
+      self.assertNotEqual(cache.fingerprint(cell, definitions), key)
+      self.assertIsNone(cache.fingerprint(
+          {"type": "text", "content": r"$\definesf{test}$"}, definitions))
+      self.assertIsNone(cache.fingerprint(
+          {"type": "text", "content": '`define("x", "y")`'}, definitions))
+      self.assertIsNotNone(cache.fingerprint(
+          {"type": "text", "content": "The map is well defined."},
+          definitions))
+
+  def test_fingerprint_values(self):
+    with tempfile.TemporaryDirectory() as path:
+      cache = BuildCache("paper", path)
+      cell = {"type": "text", "content": "Items: `items`, `scale(3)`."}
+      definitions = {"items": ["a", "b"], "scale": lambda v: v * 2}
+      key = cache.fingerprint(cell, definitions)
+      definitions["items"] = ["c"]
+      self.assertNotEqual(cache.fingerprint(cell, definitions), key)
+      key = cache.fingerprint(cell, definitions)
+      definitions["scale"] = lambda v: v * 5
+      self.assertNotEqual(cache.fingerprint(cell, definitions), key)
+      key = cache.fingerprint(cell, definitions)
+      definitions["scale"] = lambda v, k=2: v * k
+      key = cache.fingerprint(cell, definitions)
+      definitions["scale"] = lambda v, k=3: v * k
+      self.assertNotEqual(cache.fingerprint(cell, definitions), key)
+      factor = 4
+      definitions["scale"] = lambda v: v * factor
+      key = cache.fingerprint(cell, definitions)
+      factor = 5
+      self.assertNotEqual(cache.fingerprint(cell, definitions), key)
+      namespace = {"N": 1}
+      exec("def scale(v):\n  return v * N\n"
+           "def fact(n):\n  return 1 if n < 2 else n * fact(n - 1)",
+           namespace)
+      definitions["scale"] = namespace["scale"]
+      key = cache.fingerprint(cell, definitions)
+      namespace["N"] = 2
+      self.assertNotEqual(cache.fingerprint(cell, definitions), key)
+      definitions["scale"] = namespace["fact"]
+      self.assertIsNotNone(cache.fingerprint(cell, definitions))
+      definitions["items"] = []
+      definitions["items"].append(definitions["items"])
+      self.assertIsNone(cache.fingerprint(cell, definitions))
+
+  def test_save(self):
+    with tempfile.TemporaryDirectory() as path:
+      cache = BuildCache("paper", path)
+      self.assertIsNone(cache.get("key"))
+      cache.set("key", "content")
+      cache.save()
+      cache = BuildCache("paper", path)
+      self.assertEqual(cache.get("key"), "content")
+      self.assertEqual((cache.hits, cache.misses), (1, 0))
+      with open(os.path.join(path, "paper.json")) as f:
+        content = f.read()
+      self.assertFalse(write_if_changed(os.path.join(path, "paper.json"),
+                                        content))
+
+
+class TestDefinitions(unittest.TestCase):
+  def test_snapshot_definitions(self):
+    """
+    A function defined in the notebook pickles by reference to __main__.
+    """
+    def notebook_function():
+      return 1
+    notebook_function.__module__ = "__main__"
+    notebook_function.__qualname__ = "notebook_function"
+    main = sys.modules["__main__"]
+    main.notebook_function = notebook_function
+    try:
+      definitions = {"a": "x", "b": [1, 2], "f": lambda: 1,
+                     "g": notebook_function, "h": [notebook_function]}
+      snapshot, unpicklable = snapshot_definitions(definitions, {})
+    finally:
+      del main.notebook_function
+    self.assertEqual(snapshot, {"a": "x", "b": [1, 2]})
+    self.assertEqual(unpicklable, {"f", "g", "h"})
+
+
+class TestFileCache(unittest.TestCase):
+  def test_evict(self):
+    with tempfile.TemporaryDirectory() as path:
+      cache = FileCache(os.path.join(path, "cache"), 10, ".png")
+      source = os.path.join(path, "view.png")
+      for i, content in enumerate(["aaaa", "bbbb", "cccc"]):
+        with open(source, "w") as f:
+          f.write(content)
+        key = cache.key(content)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.put(key, source), cache.path(key))
+        os.utime(cache.path(key), (i, i))
+      self.assertIsNone(cache.get(cache.key("aaaa")))
+      self.assertIsNotNone(cache.get(cache.key("bbbb")))
+      self.assertEqual(cache.info()[1:], (2, 8, 10))
+      with open(source, "w") as f:
+        f.write("d" * 11)
+      self.assertEqual(cache.put(cache.key("d"), source), source)
+      cache.clear()
+      self.assertEqual(cache.info().entries, 0)
+
+  def test_concurrent_put(self):
+    """
+    Threads putting the same key while evicting each other's files.
+    """
+    with tempfile.TemporaryDirectory() as path:
+      cache = FileCache(os.path.join(path, "cache"), 40, ".png")
+      errors = []
+
+      def put(i):
+        source = os.path.join(path, f"view{i}.png")
+        with open(source, "w") as f:
+          f.write("x" * 10)
+        try:
+          for j in range(20):
+            cache.put(cache.key("same" if j % 2 == 0 else f"{i}-{j}"),
+                      source)
+            cache.get(cache.key("same"))
+        except Exception as e:
+          errors.append(e)
+
+      threads = [threading.Thread(target=put, args=(i,)) for i in range(8)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      self.assertEqual(errors, [])
+      with open(cache.put(cache.key("same"),
+                          os.path.join(path, "view0.png"))) as f:
+        self.assertEqual(f.read(), "x" * 10)
+      self.assertEqual([name for name in os.listdir(cache._path)
+                        if name.endswith(".tmp")], [])
+
+
+class TestFiles(unittest.TestCase):
+  def test_copy_if_changed(self):
+    with tempfile.TemporaryDirectory() as path:
+      source, target = os.path.join(path, "a"), os.path.join(path, "b")
+      with open(source, "w") as f:
+        f.write("template")
+      self.assertTrue(copy_if_changed(source, target))
+      self.assertFalse(copy_if_changed(source, target))
+      self.assertTrue(write_if_changed(target, "generated"))
+      self.assertTrue(copy_if_changed(source, target))
+      with open(target) as f:
+        self.assertEqual(f.read(), "template")
+      self.assertEqual(sorted(os.listdir(path)), ["a", "b"])
+
+
+if __name__ == "__main__":
+  unittest.main()
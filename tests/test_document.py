@@ -0,0 +1,138 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+import juptex.document
+import juptex.reference
+from juptex import tracing
+from juptex.document import *
+
+
+def make_cells():
+  cells = [("markdown", "## Introduction")]
+  for i in range(8):
+    cells.append(("markdown", f"Paragraph {i} with $\\vec{{x}}_{{{i}}}$, "
+                              f"**bold** and `2**{i}`."))
+  cells.append(("markdown", "Twice three is `twice(3)`."))
+  cells.append(("markdown", '`define("foo", r"\\mathsf{F}")`Defined.'))
+  for i in range(4):
+    cells.append(("markdown", f"After {i}: $\\foo_{{{i}}}$."))
+  return [(index, *cell) for index, cell in enumerate(cells)]
+
+
+def compile_document(workers):
+  dm = DocumentManager("test")
+  dm.disable_build_cache()
+  dm.define("twice", lambda x: 2 * x)
+  if workers > 0:
+    dm.parallel(workers)
+  cells = dm.preprocess_cells(make_cells())
+  return list(dm.compile_cells(dm.process_cells(cells, False), False))
+
+
+class TestDocument(unittest.TestCase):
+  def test_parallel(self):
+    serial = compile_document(0)
+    tracing.enable()
+    try:
+      self.assertEqual(compile_document(2), serial)
+    finally:
+      tracing.disable()
+    """
+    The cell calling define is a barrier, so the pool runs once for the
+    cells before it and once for the cells after it.
+    """
+    self.assertEqual(tracing.summary()["compile_pending"][0], 2)
+    contents = [cell["content"] for cell in serial]
+    self.assertIn("Twice three is 6.", contents)
+    self.assertIn(r"After 3: $\mathsf{F}_{3}$.", contents)
+
+  def test_labels(self):
+    """
+    A label-like name defined by a cell, and one only referred to in a
+    slide left out of the essay, are not unknown labels.
+    """
+    dm = DocumentManager("test")
+    dm.disable_build_cache()
+    cells = dm.process_cells(dm.preprocess_cells([
+        (0, "markdown", '`define("thm_x", "Theorem~1")`'),
+        (1, "markdown", "See `thm_x`."),
+        (2, "markdown", "---\n#### Details\nBy `thm_y`."),
+        (3, "markdown", "---"),
+    ]), False)
+    contents = [cell["content"] for cell in dm.compile_cells(cells, False)]
+    self.assertIn("See Theorem~1.", contents)
+    with self.assertRaises(LabelError):
+      dm.process_cells(dm.preprocess_cells([
+          (0, "markdown", "See `thm_z`.")]), False)
+
+  def test_streaming(self):
+    """
+    The first cell comes out once the cell after it is compiled, to know
+    that it is not merged, and before any other cell is compiled.
+    """
+    dm = DocumentManager("test")
+    dm.disable_build_cache()
+    cells = dm.process_cells(dm.preprocess_cells(make_cells()), False)
+    with mock.patch.object(DocumentManager, "_compile_text", autospec=True,
+                           side_effect=lambda self, cell: cell["content"]) \
+        as compile_text:
+      compiled = dm.compile_cells(cells, False)
+      self.assertEqual(next(compiled)["content"],
+                       r"\section{Introduction}\label{sec:introduction}")
+      self.assertEqual(compile_text.call_count, 1)
+      next(compiled)
+      self.assertEqual(compile_text.call_count, 2)
+      self.assertGreater(len(list(compiled)), 10)
+
+  def test_export(self):
+    with tempfile.TemporaryDirectory() as root:
+      notebook = os.path.join(root, "paper")
+      bib = os.path.join(root, "reference.bib")
+      with open(bib, "w") as f:
+        f.write("@misc{known, title={Known}}\n")
+
+      def export(cells):
+        with open(notebook + ".ipynb", "w") as f:
+          json.dump({"cells": [
+              {"cell_type": cell_type, "source": source}
+              for cell_type, source in cells]}, f)
+        dm = DocumentManager("paper")
+        dm.disable_build_cache()
+        dm(notebook)
+        return dm
+
+      with mock.patch.object(juptex.document, "essay_path", root), \
+           mock.patch.object(juptex.reference, "bib_path", bib):
+        path = os.path.join(root, "paper")
+        dm = export([
+            ("markdown", "# A <date> title"),
+            ("raw", "ignored"),
+            ("markdown", "## Introduction"),
+            ("markdown", "First, see \\cite{known}.\n\nSecond."),
+        ])
+        with open(os.path.join(path, "main.tex")) as f:
+          self.assertIn(r"\title{A <date> title}", f.read())
+        with open(os.path.join(path, "body.tex")) as f:
+          body = f.read()
+        self.assertEqual(body.split("\n\n")[1:],
+                         [r"First, see~\cite{known}.", "Second."])
+        self.assertEqual(dm._source_map["body.tex"], [(1, 2), (3, 3), (5, 3)])
+        with open(os.path.join(path, "reference.bib")) as f:
+          self.assertIn("known", f.read())
+
+        with self.assertRaises(Exception):
+          export([
+              ("markdown", "# A <date> title"),
+              ("markdown", "## Introduction"),
+              ("markdown", "See \\cite{unknown}."),
+          ])
+        with open(os.path.join(path, "body.tex")) as f:
+          self.assertEqual(f.read(), body)
+        self.assertEqual([name for name in os.listdir(path)
+                          if name.endswith(".tmp")], [])
+
+
+if __name__ == "__main__":
+  unittest.main()
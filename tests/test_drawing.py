@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import juptex.drawing
+from juptex.cache import FileCache
+from juptex.drawing import *
+
+
+class TestDrawing(unittest.TestCase):
+  def test_render_drawing(self):
+    rendered = []
+
+    def render(source, fit=False):
+      rendered.append((source, fit))
+      return f"\\tikz{{{len(rendered)}}}"
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+      os.chdir(root)
+      try:
+        os.makedirs("data")
+        with open(drawing_path("a"), "w") as f:
+          f.write('{"picture": []}')
+        cache = FileCache(os.path.join(root, "cache"), 1024, ".tex")
+        with mock.patch.object(juptex.drawing, "drawing_cache", cache), \
+             mock.patch.object(juptex.drawing, "render_picture", render):
+          self.assertEqual(render_drawing("a"), "\\tikz{1}")
+          self.assertEqual(render_drawing("a"), "\\tikz{1}")
+          self.assertEqual(render_drawing("a", fit=True), "\\tikz{2}")
+          with open(drawing_path("a"), "w") as f:
+            f.write('{"picture": [1]}')
+          self.assertEqual(render_drawing("a"), "\\tikz{3}")
+          render_drawings(["a", "a"], fit=True, workers=4)
+          self.assertEqual(render_drawing("a", fit=True), "\\tikz{4}")
+      finally:
+        os.chdir(cwd)
+    self.assertEqual(rendered[-1], (b'{"picture": [1]}', True))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import warnings
+from juptex.labels import *
+from juptex.errors import LabelError
+
+
+class TestLabelRegistry(unittest.TestCase):
+  def test_check(self):
+    labels = LabelRegistry()
+    labels.register("thm_main", "thm:main", r"Theorem~\ref{thm:main}")
+    labels.register("fig_overview", "fig:overview",
+                    r"Figure~\ref{fig:overview}")
+    self.assertEqual(labels["thm_main"].kind, "thm")
+    labels.refer("By `thm_main` and `fig_overview`, `2**5` is `tab_costs`.")
+    labels.refer("```matheq\nx\n```")
+    self.assertEqual(labels.unknown({}), ["tab_costs"])
+    self.assertEqual(labels.unknown({"tab_costs": "Table"}), [])
+    labels.refer('`define("tab_costs", "Table~1")` and `thm_other`')
+    self.assertEqual(labels.unknown({}), ["thm_other"])
+    with self.assertRaises(LabelError):
+      labels.check({})
+
+    labels.register("fig_overview", "fig:overview",
+                    r"Figure~\ref{fig:overview}")
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter("always")
+      labels.check({"thm_other": "Theorem"})
+    self.assertIn("fig_overview", str(caught[0].message))
+
+
+if __name__ == "__main__":
+  unittest.main()
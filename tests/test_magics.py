@@ -0,0 +1,39 @@
+import sys
+import unittest
+import juptex
+from juptex.magics import *
+
+
+class FakeShell(object):
+  def __init__(self):
+    self.magics = {}
+
+  def register_magic_function(self, func, magic_kind="line"):
+    self.magics[func.__name__] = magic_kind
+
+
+class TestMagics(unittest.TestCase):
+  def test_load_ipython_extension(self):
+    shell = FakeShell()
+    juptex.load_ipython_extension(shell)
+    self.assertEqual(shell.magics["block_math"], "cell")
+    self.assertEqual(shell.magics["draw"], "line")
+    self.assertEqual(len(shell.magics), len(cell_magics) + len(line_magics))
+
+  def test_lazy_attributes(self):
+    self.assertIs(juptex.Document,
+                  sys.modules["juptex.document"].DocumentManager)
+    self.assertIs(juptex.the_text_manager, get_text_manager())
+    with self.assertRaises(AttributeError):
+      juptex.missing
+
+  def test_star_import(self):
+    names = {}
+    exec("from juptex import *", names)
+    for name in ["Document", "TextManager", "genpng", "isnotebook",
+                 "the_text_manager", "load_ipython_extension"]:
+      self.assertIn(name, names)
+
+
+if __name__ == "__main__":
+  unittest.main()
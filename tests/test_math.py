@@ -1,4 +1,5 @@
 import unittest
+import threading
 from juptex.matheq import *
 
 
@@ -37,6 +38,59 @@ f( ):=
 """), r"\mathsf{test}")
     self.assertEqual(mm(r"\vtest"), r"\boldsymbol{\mathsf{\mathsf{test}}}")
 
+  def test_generated(self):
+    mm = MathManager()
+    self.assertEqual(
+        mm("!'+'.join(r'\\paren{\\bbF_{%d}}' % i for i in range(1000))"),
+        "+".join(r"\left(\mathbb{F}_{%d}\right)" % i for i in range(1000)))
+
+  def test_cache(self):
+    mm = MathManager()
+    mm.define("field", mm.get("bbF"))
+    self.assertEqual(mm(r"\field"), r"\mathbb{F}")
+    self.assertEqual(mm(r"\field"), r"\mathbb{F}")
+    self.assertEqual(mm.cache_info()[:2], (1, 1))
+    mm.define("field", mm.get("bbZ"))
+    self.assertEqual(mm(r"\field"), r"\mathbb{Z}")
+    self.assertEqual(mm.cache_info()[:2], (1, 2))
+    mm.define("count", [0])
+    mm.define("incr", lambda c: c.append(0) or str(len(c)))
+    self.assertEqual(mm(r"!incr(count)"), "2")
+    self.assertEqual(mm(r"!incr(count)"), "3")
+
+  def test_cache_threads(self):
+    mm = MathManager()
+    mm._cache_size = 4
+    errors = []
+
+    def compile_all():
+      try:
+        for i in range(200):
+          self.assertEqual(mm(r"\bbF_{%d}" % (i % 8)),
+                           r"\mathbb{F}_{%d}" % (i % 8))
+      except Exception as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=compile_all) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(errors, [])
+    hits, misses, size, entries = mm.cache_info()
+    self.assertEqual(hits + misses, 8 * 200)
+    self.assertLessEqual(entries, size)
+
+  def test_common_definitions(self):
+    mm, other = MathManager(), MathManager()
+    mm.define("bbF", r"\mathbf{F}")
+    self.assertEqual(mm(r"\bbF"), r"\mathbf{F}")
+    self.assertEqual(other(r"\bbF"), r"\mathbb{F}")
+    self.assertIn("sfP", mm._locals)
+    self.assertNotIn("bbF", other._locals.keys())
+    self.assertEqual(mm(r"!'+'.join(paren(bb_x) for _ in range(2))"),
+                     r"\left(\mathbb{x}\right)+\left(\mathbb{x}\right)")
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,38 @@
+import pickle
+import unittest
+from types import MappingProxyType
+from juptex.namespace import *
+
+
+class TestNamespace(unittest.TestCase):
+  def test_setdefault(self):
+    namespace = Namespace({"bbF": r"\mathbb{F}"})
+    generation = namespace.generation
+    self.assertEqual(namespace.setdefault("bbF", "x"), r"\mathbb{F}")
+    self.assertEqual(namespace.generation, generation)
+    self.assertEqual(len(namespace), 0)
+    self.assertEqual(namespace.setdefault("field", r"\bbF"), r"\bbF")
+    self.assertEqual(namespace.generation, generation + 1)
+    self.assertEqual(namespace.setdefault("field", "x"), r"\bbF")
+    self.assertEqual(namespace.generation, generation + 1)
+
+  def test_scope(self):
+    namespace = Namespace({"a": 1})
+    namespace["b"] = 2
+    self.assertEqual(namespace.scope(), {"a": 1, "b": 2})
+    namespace["a"] = 3
+    self.assertEqual(namespace.scope(), {"a": 3, "b": 2})
+    self.assertEqual(dict(namespace), {"a": 3, "b": 2})
+
+  def test_pickle(self):
+    namespace = Namespace(MappingProxyType({"a": 1}))
+    namespace["b"] = 2
+    namespace.scope()
+    copy = pickle.loads(pickle.dumps(namespace))
+    self.assertIsInstance(copy, Namespace)
+    self.assertEqual(dict(copy), {"b": 2})
+    self.assertNotIn("a", copy)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -25,6 +25,13 @@ print("Hello")
 a = abs(math.sin(100))""")
     ])
 
+  def test_iter_cells(self):
+    cells = iter_cells("data/Test")
+    self.assertEqual(next(cells), (0, "markdown", "# Title"))
+    self.assertEqual(list(cells)[-1], (9, "code", """import math
+print("Hello")
+a = abs(math.sin(100))"""))
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,153 @@
+import os
+import stat
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import juptex.preview
+from juptex.preview import *
+
+try:
+  import pymupdf
+except ImportError:
+  pymupdf = None
+
+
+class TestPreview(unittest.TestCase):
+  @unittest.skipIf(pymupdf is None, "pymupdf is not installed")
+  def test_rasterize(self):
+    with tempfile.TemporaryDirectory() as path:
+      pdf, png = os.path.join(path, "view.pdf"), os.path.join(path, "view.png")
+      doc = pymupdf.open()
+      page = doc.new_page(width=600, height=800)
+      page.draw_rect(pymupdf.Rect(100, 100, 172, 136), fill=(0, 0, 0))
+      doc.save(pdf)
+      rasterize(pdf, png)
+      pixmap = pymupdf.Pixmap(png)
+      scale = preview_dpi / 72
+      self.assertAlmostEqual(pixmap.width, 72 * scale, delta=5)
+      self.assertAlmostEqual(pixmap.height, 36 * scale, delta=5)
+
+  def test_stale_format(self):
+    """
+    A format dumped before a TeX Live update, and a stub pdflatex that
+    fails whenever a format is given.
+    """
+    with tempfile.TemporaryDirectory() as path:
+      bin_path, formats = os.path.join(path, "bin"), os.path.join(path, "fmt")
+      os.makedirs(bin_path)
+      os.makedirs(formats)
+      log = os.path.join(path, "calls.log")
+      stub = os.path.join(bin_path, "pdflatex")
+      with open(stub, "w") as f:
+        f.write(f"#!/bin/sh\necho \"$*\" >> '{log}'\n"
+                "case \"$*\" in *-fmt=*) exit 1;; esac\n")
+      os.chmod(stub, os.stat(stub).st_mode | stat.S_IEXEC)
+      content = enclose_with_template("$x$")
+      preamble = content[:content.find("\\begin{document}")]
+      name = "juptex-" + hashlib.sha256(preamble.encode()).hexdigest()[:16]
+      with open(os.path.join(formats, name + ".fmt"), "w") as f:
+        f.write("stale")
+      failed = set()
+      with mock.patch.object(juptex.preview, "format_path", formats), \
+           mock.patch.object(juptex.preview, "failed_formats", failed):
+        self.assertEqual(ensure_format(preamble), name)
+        with mock.patch.object(juptex.preview, "preview_backend", "format"), \
+             mock.patch.dict(os.environ, {
+                 "PATH": bin_path + os.pathsep + os.environ["PATH"]}):
+          for _ in range(2):
+            self.assertTrue(genpdf("$x$", workdir=os.path.join(path, "view")))
+      self.assertIn(name, failed)
+      self.assertFalse(os.path.exists(os.path.join(formats, name + ".fmt")))
+      with open(log) as f:
+        calls = f.read().splitlines()
+      self.assertEqual(["-fmt" in call for call in calls],
+                       [True, False, False])
+
+  def test_submit_preview(self):
+    """
+    Stub genpdf and the rasterizer: the jobs wait for each other so that
+    they really run at the same time, each in its own working directory.
+    """
+    workdirs = []
+    barrier = threading.Barrier(3, timeout=10)
+
+    def fake_genpdf(content, meta=None, workdir="./view"):
+      if content == "bad":
+        return False
+      workdirs.append(workdir)
+      barrier.wait()
+      with open(os.path.join(workdir, "view.pdf"), "w") as f:
+        f.write(content)
+      return True
+
+    def fake_rasterize(pdf, output, crop=True):
+      with open(pdf) as f, open(output, "w") as g:
+        g.write(f.read().upper())
+
+    with tempfile.TemporaryDirectory() as path:
+      cache = FileCache(path, 1 << 20)
+      with mock.patch.object(juptex.preview, "preview_cache", cache), \
+           mock.patch.object(juptex.preview, "preview_executor", None), \
+           mock.patch.object(juptex.preview, "preview_workers", 4), \
+           mock.patch.object(juptex.preview, "genpdf", fake_genpdf), \
+           mock.patch.object(juptex.preview, "rasterize", fake_rasterize):
+        contents = ["a", "b", "c"]
+        futures = [submit_preview(content) for content in contents]
+        failed = submit_preview("bad")
+        self.assertEqual([future.result(timeout=10) for future in futures],
+                         [b"A", b"B", b"C"])
+        with self.assertRaises(Exception):
+          failed.result(timeout=10)
+        for content in contents:
+          self.assertIsNotNone(cache.get(preview_key(content)))
+        self.assertIsNone(cache.get(preview_key("bad")))
+        self.assertEqual(submit_preview("a").result(), b"A")
+        juptex.preview.preview_executor.shutdown()
+      self.assertEqual(len(set(workdirs)), 3)
+      self.assertEqual(juptex.preview.preview_jobs, {})
+      self.assertFalse(any(os.path.exists(workdir) for workdir in workdirs))
+
+  def test_submit_same_preview(self):
+    """
+    Threads asking for the same preview while it is rendered share one job.
+    """
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fake_render_preview(content, meta=None, crop=True, workdir="./view"):
+      calls.append(content)
+      started.set()
+      release.wait(10)
+      output = os.path.join(workdir, "view.png")
+      with open(output, "w") as f:
+        f.write(content)
+      return output
+
+    with tempfile.TemporaryDirectory() as path:
+      cache = FileCache(path, 1 << 20)
+      with mock.patch.object(juptex.preview, "preview_cache", cache), \
+           mock.patch.object(juptex.preview, "preview_executor", None), \
+           mock.patch.object(juptex.preview, "preview_workers", 4), \
+           mock.patch.object(juptex.preview, "render_preview",
+                             fake_render_preview):
+        futures = [submit_preview("a")]
+        started.wait(10)
+        threads = [threading.Thread(
+            target=lambda: futures.append(submit_preview("a")))
+            for _ in range(8)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+        release.set()
+        self.assertEqual({future.result(timeout=10) for future in futures},
+                         {b"a"})
+        self.assertEqual(len({id(future) for future in futures}), 1)
+        juptex.preview.preview_executor.shutdown()
+      self.assertEqual(calls, ["a"])
+
+
+if __name__ == "__main__":
+  unittest.main()
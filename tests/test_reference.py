@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from juptex.reference import *
+
+
+bib = r"""
+@string{ jcrypt = "Journal of Cryptology" }
+@comment{ not an entry }
+@article{Alpha2020,
+  title = {On {N}ested {B}races},
+  author = {Smith, A. and Doe, J.},
+  journal = jcrypt,
+  abstract = {Removed},
+  year = {2020},
+}
+@inproceedings(beta2021,
+  title = "Parentheses (and more)",
+  author = {Roe, R.},
+  year = 2021
+)
+"""
+
+
+class TestReference(unittest.TestCase):
+  def test_index(self):
+    with tempfile.TemporaryDirectory() as path:
+      bib_file = os.path.join(path, "reference.bib")
+      with open(bib_file, "w") as f:
+        f.write(bib)
+      index = BibIndex(bib_file)
+      self.assertEqual(len(index), 2)
+      self.assertTrue(os.path.exists(bib_file + ".index"))
+      index = BibIndex(bib_file)
+      self.assertIn("alpha2020", index)
+      self.assertNotIn("gamma", index)
+      self.assertEqual(index["Alpha2020"].fields["journal"],
+                       "Journal of Cryptology")
+      self.assertEqual(index["beta2021"].fields["title"],
+                       "Parentheses (and more)")
+
+      reference = Reference(index)
+      reference.extract_citations(r"See \cite{Alpha2020, beta2021}.")
+      self.assertNotIn("abstract", reference.filtered_database.entries[
+          "Alpha2020"].fields)
+      with self.assertRaises(Exception):
+        reference.extract_citations(r"\cite{gamma}")
+
+      with open(bib_file, "a") as f:
+        f.write("@misc{gamma, title = {G}}\n")
+      self.assertIn("gamma", BibIndex(bib_file))
+
+  def test_extract_citations(self):
+    with tempfile.TemporaryDirectory() as path:
+      bib_file = os.path.join(path, "reference.bib")
+      with open(bib_file, "w") as f:
+        f.write(bib)
+      reference = Reference(BibIndex(bib_file))
+      reference.extract_citations(
+          r"\citep[see][p.~3]{Alpha2020} and \citet*{beta2021,Alpha2020}")
+      self.assertEqual(list(reference.filtered_database.entries.keys()),
+                       ["Alpha2020", "beta2021"])
+
+
+if __name__ == "__main__":
+  unittest.main()
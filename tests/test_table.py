@@ -1,4 +1,8 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
+import juptex.table
 from juptex.table import *
 
 
@@ -37,5 +41,34 @@ G &  & \\
 \end{table}""")
 
 
+  def test_read_numbers(self):
+    with tempfile.TemporaryDirectory() as root:
+      tables = read_numbers("data/test.numbers", root)
+      self.assertEqual(len(tables), 1)
+      self.assertEqual(tables[0][0][0], ("text", "col1", (1, 1)))
+      self.assertEqual(tables[0][1][0][2], (1, 3))
+      with mock.patch.object(juptex.table, "extract_numbers",
+                             side_effect=AssertionError):
+        self.assertEqual(read_numbers("data/test.numbers", root), tables)
+
+  def test_file_signature(self):
+    """
+    Editing a file inside a package leaves the time of the directory as is.
+    """
+    with tempfile.TemporaryDirectory() as root:
+      package = os.path.join(root, "paper.numbers")
+      os.makedirs(os.path.join(package, "Index"))
+      name = os.path.join(package, "Index", "Document.iwa")
+      with open(name, "w") as f:
+        f.write("a")
+      os.utime(package, ns=(10 ** 9, 10 ** 9))
+      os.utime(name, ns=(10 ** 9, 10 ** 9))
+      signature = file_signature(package)
+      with open(name, "w") as f:
+        f.write("b")
+      os.utime(package, ns=(10 ** 9, 10 ** 9))
+      self.assertNotEqual(file_signature(package), signature)
+
+
 if __name__ == "__main__":
   unittest.main()
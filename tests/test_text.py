@@ -31,6 +31,11 @@ Hello \underline{world} $\mathsf{C}$, hello \"world Hello, hello world.
 , ``hello world'', 32 hello world \[\mathbb{\Alpha}\].
 """)
 
+  def test_reuse(self):
+    tm = TextManager()
+    self.assertEqual(tm('Unclosed "quote'), "Unclosed ``quote")
+    self.assertEqual(tm('Another "quote"'), "Another ``quote''")
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,73 @@
+import os
+import json
+import tempfile
+import unittest
+from juptex import tracing
+from juptex.document import DocumentManager
+
+
+def make_cells():
+  return [
+      (0, "markdown", "## Introduction"),
+      (1, "markdown", "Paragraph with $x$ and `2**5`."),
+      (2, "code", "%%block_math align\na &= b"),
+      (3, "markdown", "Another paragraph with $y$."),
+  ]
+
+
+class TestTracing(unittest.TestCase):
+  def tearDown(self):
+    tracing.disable()
+    tracing.reset()
+
+  def test_disabled(self):
+    self.assertIs(tracing.span("x"), tracing.no_span)
+    self.assertIsNone(tracing.begin())
+    dm = DocumentManager("test")
+    dm.disable_build_cache()
+    list(dm.compile_cells(dm.process_cells(
+        dm.preprocess_cells(make_cells()), False), False))
+    self.assertEqual(tracing.spans, [])
+    self.assertEqual(len(tracing.counters), 0)
+
+  def test_cells(self):
+    tracing.enable()
+    dm = DocumentManager("test")
+    dm.disable_build_cache()
+    list(dm.compile_cells(dm.process_cells(
+        dm.preprocess_cells(make_cells()), False), False))
+    summary = tracing.summary()
+    self.assertEqual(summary["compile_cells"][0], 1)
+    self.assertIn("text", summary)
+    self.assertIn("math", summary)
+    self.assertEqual(tracing.counters["python.evals"], 1)
+    """
+    The last paragraph is merged into the first one after the equation.
+    """
+    cells = tracing.slowest_cells()
+    self.assertEqual(sorted(index for index, _, _ in cells), [0, 1, 2])
+    self.assertEqual(dict((index, type_) for index, type_, _ in cells)[2],
+                     "math")
+
+    with tempfile.TemporaryDirectory() as root:
+      path = os.path.join(root, "trace.json")
+      tracing.dump(path)
+      with open(path) as f:
+        data = json.load(f)
+    self.assertEqual(len(data["traceEvents"]), len(tracing.spans))
+    self.assertEqual(data["traceEvents"][0]["ph"], "X")
+    self.assertEqual(data["counters"]["python.evals"], 1)
+
+  def test_span(self):
+    tracing.enable()
+    with tracing.span("outer", x=1):
+      with tracing.span("inner"):
+        pass
+    inner, outer = tracing.spans
+    self.assertEqual((outer[0], outer[4]), ("outer", {"x": 1}))
+    self.assertLessEqual(outer[1], inner[1])
+    self.assertGreaterEqual(outer[2], inner[2])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -24,5 +24,10 @@ class TestFindFirstUnescapedQuote(unittest.TestCase):
     self.assertEqual(find_first_unescaped_quote(r'hello "wor\\"ld'), 6)
     self.assertEqual(find_first_unescaped_quote(r'hello \"wor\\"ld'), 13)
 
+  def test_compile_expression(self):
+    code = compile_expression(' 2 ** n')
+    self.assertIs(compile_expression(' 2 ** n'), code)
+    self.assertEqual(eval(code, {'n': 5}), 32)
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
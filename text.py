@@ -1,3 +1,5 @@
+import keyword
+from juptex import tracing
 from juptex.config import *
 from juptex.errors import *
 from juptex.matheq import MathManager
@@ -11,6 +13,20 @@ class TextManager(object):
                           else MathManager())
     self._locals = self._math_manager._locals
     self.define("mm", self._math_manager)
+    self._scanner = Scanner([
+      MatheqTranspiler(self._math_manager),
+      BlockMathTranspiler(self._math_manager),
+      MathTranspiler(self._math_manager),
+      BoldTranspiler(),
+      EmphTranspiler(),
+      UnderlineTranspiler(),
+      HideTranspiler(),
+      CiteTranspiler(),
+      RawTranspiler(),
+      PreTranspiler(),
+      DquoteTranspiler(),
+      PythonTranspiler(self._locals),
+    ])
 
   def get(self, key):
     return self._locals[key]
@@ -41,46 +57,67 @@ class TextManager(object):
   def render_meta(self):
     return self._math_manager.render_meta()
 
+  @tracing.traced("text")
   def __call__(self, content):
-    transpilers = [
-      MatheqTranspiler(self._math_manager),
-      BlockMathTranspiler(self._math_manager),
-      MathTranspiler(self._math_manager),
-      BoldTranspiler(),
-      EmphTranspiler(),
-      UnderlineTranspiler(),
-      HideTranspiler(),
-      CiteTranspiler(),
-      RawTranspiler(),
-      PreTranspiler(),
-      DquoteTranspiler(),
-      PythonTranspiler(self._locals),
-    ]
     content = content.replace(space_placeholder, " ")
-    buffer, past = [], ""
-    while len(content) > 0:
-      transpiler, start, end = None, None, None
-      for t in transpilers:
-        s, e = t.find(content)
-        if s is not None and (start is None or s < start):
-          transpiler, start, end = t, s, e
-      if transpiler is None:
-        buffer.append(content)
-        content = ""
-        break
-      if end is None:
-        info = (past+content)[max(start+len(past)-20,0):
-                              min(start+len(past)+20,len(content)+len(past))]
-        raise ValueError(f"Unended {transpiler}: ... '{info}' ...\nin\n{past+content}")
-      buffer.append(content[:start])
-      buffer.append(transpiler.transpile(transpiler.trim(content[start:end])))
-      past += content[:end]
-      content = content[end:]
-      
+    buffer, pos = [], 0
+    context = TranspileContext()
+    for transpiler, start, end in self._scanner.scan(content):
+      buffer.append(content[pos:start])
+      buffer.append(transpiler.transpile(transpiler.trim(content[start:end]),
+                                         context))
+      pos = end
+    buffer.append(content[pos:])
     ret = "".join(buffer)
     ret = ret.replace(" \\cite{", "~\\cite{")
     return ret
-  
+
+
+class TranspileContext(object):
+  """
+  The state of a single call of TextManager, so that the transpilers
+  themselves hold no state and can be reused, also across threads.
+  """
+
+  def __init__(self):
+    self.dquote_open = False
+
+
+class Scanner(object):
+  """
+  Locate the marks of all the transpilers in one left-to-right pass.
+
+  The next start of every transpiler is remembered and only searched
+  again once the scanning position has moved beyond it, so each
+  transpiler reads the content at most once. Among the marks starting at
+  the same position, the transpiler that comes first in the list wins.
+  """
+
+  def __init__(self, transpilers):
+    self._transpilers = transpilers
+
+  def scan(self, content):
+    starts = [t.find_start(content, 0) for t in self._transpilers]
+    pos = 0
+    while pos < len(content):
+      transpiler, start = None, None
+      for i, t in enumerate(self._transpilers):
+        s = starts[i]
+        if s is not None and s < pos:
+          s = starts[i] = t.find_start(content, pos)
+        elif (s is None or s > pos) and t.anchored_at(content, pos):
+          s = starts[i] = pos
+        if s is not None and (start is None or s < start):
+          transpiler, start = t, s
+      if transpiler is None:
+        return
+      end = transpiler.find_end(content, start)
+      if end is None:
+        info = content[max(start-20, 0):min(start+20, len(content))]
+        raise ValueError(f"Unended {transpiler}: ... '{info}' ...\nin\n{content}")
+      yield transpiler, start, end
+      pos = end
+
 
 class Transpiler(object):
   def __init__(self,
@@ -94,42 +131,77 @@ class Transpiler(object):
     self._suffix = suffix
     
   def find(self, s):
-    start = s.find(self._start_mark)
-    if start < 0:
+    start = self.find_start(s, 0)
+    if start is None:
       return None, None
+    return start, self.find_end(s, start)
+
+  def find_start(self, s, pos):
+    start = s.find(self._start_mark, pos)
+    if start < 0:
+      return None
+    return start
+
+  def anchored_at(self, s, pos):
+    """
+    Whether a mark that is only recognized at special positions
+    starts right at the scanning position.
+    """
+    return False
+
+  def find_end(self, s, start):
     end = s.find(self._end_mark, start + len(self._start_mark))
     if end < 0:
-      return start, None
-    return start, end + len(self._end_mark)
+      return None
+    return end + len(self._end_mark)
   
   def trim(self, s):
     return s[len(self._start_mark):-len(self._end_mark)]
   
-  def transpile(self, s):
+  def transpile(self, s, context=None):
     return self._prefix + s + self._suffix
   
   def __str__(self):
     return self._start_mark
 
 
+matheq_start_pattern = re.compile(r"^```matheq", re.MULTILINE)
+matheq_end_pattern = re.compile(r"^```$", re.MULTILINE)
+
+
 class MatheqTranspiler(Transpiler):
   def __init__(self, math_manager):
     super().__init__()
     self._math_manager = math_manager
   
-  def find(self, s):
-    match = re.search(r"^```matheq", s, re.MULTILINE)
+  def find_start(self, s, pos):
+    """
+    The scanning position counts as the start of a line, as the content
+    before it has been consumed.
+    """
+    if self.anchored_at(s, pos):
+      return pos
+    match = matheq_start_pattern.search(s, pos)
     if not match:
-      return None, None
-    end_match = re.search(r"^```$", s[match.span()[1]:], re.MULTILINE)
-    if not end_match:
-      return match.span()[0], None
-    return match.span()[0], match.span()[1] + end_match.span()[1]
+      return None
+    return match.start()
+
+  def anchored_at(self, s, pos):
+    return s.startswith("```matheq", pos)
+
+  def find_end(self, s, start):
+    start += len("```matheq")
+    if s.startswith("```", start) and s[start+3:start+4] in ["", "\n"]:
+      return start + 3
+    match = matheq_end_pattern.search(s, start)
+    if not match:
+      return None
+    return match.end()
   
   def trim(self, s: str):
     return s
   
-  def transpile(self, s):
+  def transpile(self, s, context=None):
     assert s.startswith("```matheq")
     assert s.endswith("\n```")
     env = s[9:s.find("\n")].strip()
@@ -156,7 +228,7 @@ class BlockMathTranspiler(Transpiler):
     super().__init__(blockmath_start_mark, blockmath_end_mark)
     self._math_manager = math_manager
   
-  def transpile(self, s):
+  def transpile(self, s, context=None):
     try:
       return f"\[{self._math_manager(s)}\]"
     except MathEquationError as e:
@@ -169,7 +241,7 @@ class MathTranspiler(Transpiler):
     super().__init__(math_start_mark, math_end_mark)
     self._math_manager = math_manager
   
-  def transpile(self, s):
+  def transpile(self, s, context=None):
     try:
       return f"${self._math_manager(s)}$"
     except MathEquationError as e:
@@ -222,7 +294,7 @@ class PreTranspiler(Transpiler):
                      pre_end_mark,
                      "", "")
   
-  def transpile(self, s):
+  def transpile(self, s, context=None):
     deliminator = find_special_char_not_in(s)
     if deliminator is None:
       raise ValueError(f"{s} contains all possible deliminators")
@@ -230,23 +302,25 @@ class PreTranspiler(Transpiler):
     
 
 class DquoteTranspiler(Transpiler):
-  def __init__(self):
-    self._open = False
-  
-  def find(self, s):
-    index = find_first_unescaped_quote(s)
+  def find_start(self, s, pos):
+    index = s.find('"', pos)
+    while index > pos and count_slashes(s, index-1) % 2 == 1:
+      index = s.find('"', index+1)
     if index < 0:
-      return None, None
-    return index, index + 1
+      return None
+    return index
+
+  def find_end(self, s, start):
+    return start + 1
   
   def trim(self, s):
     return s
   
-  def transpile(self, s):
-    if not self._open:
-      self._open = True
+  def transpile(self, s, context):
+    if not context.dquote_open:
+      context.dquote_open = True
       return '``'
-    self._open = False
+    context.dquote_open = False
     return "''"
   
   def __str__(self):
@@ -258,16 +332,22 @@ class PythonTranspiler(Transpiler):
     super().__init__(python_start_mark, python_end_mark)
     self._vars = vars
   
-  def transpile(self, s):
-    if self._vars is not None:
-      for key, value in self._vars.items():
-        locals()[key] = value
-    return str(eval(s, globals(), locals()))
+  def transpile(self, s, context=None):
+    """
+    Plain names, mostly references to labels, are looked up directly.
+    """
+    if self._vars is None:
+      return str(eval(compile_expression(s), globals()))
+    if s.isidentifier() and not keyword.iskeyword(s) and s in self._vars:
+      tracing.count("python.lookups")
+      return str(self._vars[s])
+    tracing.count("python.evals")
+    return str(eval(compile_expression(s), globals(), self._vars))
 
 
 class HideTranspiler(Transpiler):
   def __init__(self):
     super().__init__(hide_start_mark, hide_end_mark, "", "")
   
-  def transpile(self, s):
+  def transpile(self, s, context=None):
     return ""
\ No newline at end of file
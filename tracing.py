@@ -0,0 +1,167 @@
+"""
+Opt-in instrumentation of the export pipeline.
+
+Nothing is recorded until enable() is called. While disabled, span()
+returns a shared no-op context manager, begin() returns None and the
+other functions return right after checking the flag.
+"""
+import os
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import nullcontext
+from collections import Counter
+
+
+enabled = False
+spans = []
+counters = Counter()
+no_span = nullcontext()
+lock = threading.Lock()
+
+
+def enable():
+  global enabled
+  reset()
+  enabled = True
+
+
+def disable():
+  global enabled
+  enabled = False
+
+
+def reset():
+  with lock:
+    spans.clear()
+    counters.clear()
+
+
+def begin():
+  if not enabled:
+    return None
+  return time.perf_counter()
+
+
+def end(name, start, **args):
+  """
+  Record a span from a start returned by begin(), unless tracing was
+  disabled when it began.
+  """
+  if start is None:
+    return
+  duration = time.perf_counter() - start
+  with lock:
+    spans.append((name, start, duration, threading.get_ident(), args))
+
+
+class Span(object):
+  def __init__(self, name, args):
+    self._name = name
+    self._args = args
+
+  def __enter__(self):
+    self._start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    end(self._name, self._start, **self._args)
+    return False
+
+
+def span(name, **args):
+  if not enabled:
+    return no_span
+  return Span(name, args)
+
+
+def traced(name):
+  """
+  Record every call of the decorated function as a span.
+  """
+  def decorator(f):
+    @wraps(f)
+    def wrap(*args, **kwargs):
+      if not enabled:
+        return f(*args, **kwargs)
+      start = time.perf_counter()
+      try:
+        return f(*args, **kwargs)
+      finally:
+        end(name, start)
+    return wrap
+  return decorator
+
+
+def count(name, n=1):
+  if enabled:
+    with lock:
+      counters[name] += n
+
+
+def summary():
+  """
+  The number of calls and the total time of every span name.
+  """
+  ret = {}
+  with lock:
+    for name, _, duration, _, _ in spans:
+      calls, total = ret.get(name, (0, 0.0))
+      ret[name] = (calls + 1, total + duration)
+  return ret
+
+
+def slowest_cells(n=10):
+  """
+  The notebook cells that took the longest to compile, as a list of
+  (index, type, seconds), where the time of a cell includes the math
+  equations folded into it.
+  """
+  totals, types = {}, {}
+  with lock:
+    for name, _, duration, _, args in spans:
+      if name in ["cell", "math_cell"] and args.get("index") is not None:
+        index = args["index"]
+        totals[index] = totals.get(index, 0.0) + duration
+        if name == "cell" or index not in types:
+          types[index] = args.get("type")
+  ret = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+  return [(index, types[index], seconds) for index, seconds in ret[:n]]
+
+
+def report(n=10):
+  print("%24s %8s %12s" % ("span", "calls", "seconds"))
+  for name, (calls, total) in sorted(summary().items(),
+                                     key=lambda item: -item[1][1]):
+    print("%24s %8d %12.4f" % (name, calls, total))
+  if len(counters) > 0:
+    print("%24s %8s" % ("counter", "value"))
+    for name, value in sorted(counters.items()):
+      print("%24s %8d" % (name, value))
+  cells = slowest_cells(n)
+  if len(cells) > 0:
+    print("%24s %8s %12s" % ("slowest cells", "index", "seconds"))
+    for index, type_, seconds in cells:
+      print("%24s %8d %12.4f" % (type_, index, seconds))
+
+
+def dump(path):
+  """
+  Write the spans in the Chrome trace event format, which can be opened
+  in chrome://tracing or Perfetto, with the counters alongside.
+  """
+  pid = os.getpid()
+  with lock:
+    events = [{
+        "name": name,
+        "ph": "X",
+        "ts": start * 1e6,
+        "dur": duration * 1e6,
+        "pid": pid,
+        "tid": tid,
+        "args": args,
+    } for name, start, duration, tid, args in spans]
+    data = {"traceEvents": events, "counters": dict(counters)}
+  with open(path, "w") as f:
+    json.dump(data, f)
@@ -1,4 +1,6 @@
 import re
+from functools import lru_cache
+from juptex.config import expression_cache_size
 
 
 def to_label(name):
@@ -84,17 +86,28 @@ def map_with_merge(lst, f, g):
   the value returned from g(lst'[last], lst[i], lst[i+1]) will replace
   lst'[last] if it is not None
   """
-  ret = []
-  for i in range(len(lst)):
-    if i == 0:
-      ret.append(f(lst[i]))
+  return list(iter_with_merge(lst, f, g))
+
+
+def iter_with_merge(iterable, f, g):
+  """
+  The same as map_with_merge, but an item is yielded as soon as the next
+  one is not merged into it, so the items are never all held at once.
+  """
+  empty, last, previous = True, None, None
+  for item in iterable:
+    if empty:
+      empty, last = False, f(item)
     else:
-      new_item = g(ret[-1], lst[i-1], lst[i])
+      new_item = g(last, previous, item)
       if new_item is not None:
-        ret[-1] = new_item
+        last = new_item
       else:
-        ret.append(f(lst[i]))
-  return ret
+        yield last
+        last = f(item)
+    previous = item
+  if not empty:
+    yield last
 
 
 def count_slashes(s, index):
@@ -149,4 +162,14 @@ def str_to_function(value):
     for i in reversed(range(1, nargs+1)):
       result = result.replace(f"#{i}", args[i-1])
     return result
-  return ret
\ No newline at end of file
+  return ret
+
+
+@lru_cache(maxsize=expression_cache_size)
+def compile_expression(s):
+  """
+  The code object of a Python expression, compiled once for all the
+  places that evaluate the same expression. Leading spaces and tabs are
+  stripped, as eval() does for a string.
+  """
+  return compile(s.lstrip(" \t"), "<string>", "eval")